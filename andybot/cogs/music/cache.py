@@ -0,0 +1,97 @@
+import json
+import sqlite3
+import threading
+import time
+from datetime import timedelta
+from typing import Tuple, Union
+
+CACHE_PATH = './data/songs.sqlite'
+# How long a song's title, thumbnail, etc. are trusted for
+METADATA_TTL = timedelta(days=30)
+# How long a search keeps pointing at the same video, since search results
+# change over time
+QUERY_TTL = timedelta(days=7)
+
+
+class SongCache:
+    """SQLite cache of yt-dlp results, keyed by video id, with every URL or
+    search that led to a video pointing at it. yt-dlp runs in executor
+    threads, so every access goes through one lock.
+    """
+
+    def __init__(self, path: str = CACHE_PATH,
+                 metadata_ttl: timedelta = METADATA_TTL,
+                 query_ttl: timedelta = QUERY_TTL) -> None:
+        self.path = path
+        self.metadata_ttl = metadata_ttl.total_seconds()
+        self.query_ttl = query_ttl.total_seconds()
+        self._conn = None
+        self._lock = threading.Lock()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            with self._conn:
+                self._conn.execute(
+                    'CREATE TABLE IF NOT EXISTS songs (video_id TEXT PRIMARY '
+                    'KEY, info TEXT, cached_at REAL, expires_at REAL)'
+                )
+                self._conn.execute(
+                    'CREATE TABLE IF NOT EXISTS queries (query TEXT PRIMARY '
+                    'KEY, video_id TEXT, cached_at REAL)'
+                )
+            self._prune()
+        return self._conn
+
+    def _prune(self) -> None:
+        now = time.time()
+        with self._conn:
+            self._conn.execute('DELETE FROM songs WHERE cached_at < ?',
+                               (now - self.metadata_ttl,))
+            self._conn.execute('DELETE FROM queries WHERE cached_at < ?',
+                               (now - self.query_ttl,))
+
+    def lookup(self, query: str) -> Union[Tuple[dict, float], None]:
+        """Gets the cached info of the video a URL or search points to, along
+        with when its stream URL expires.
+        """
+        now = time.time()
+        with self._lock:
+            try:
+                row = self.conn.execute(
+                    'SELECT songs.info, songs.expires_at FROM queries '
+                    'JOIN songs ON songs.video_id = queries.video_id '
+                    'WHERE queries.query = ? AND queries.cached_at > ? '
+                    'AND songs.cached_at > ?',
+                    (query, now - self.query_ttl, now - self.metadata_ttl)
+                ).fetchone()
+            except sqlite3.Error as e:
+                print(f'Warning: Song cache lookup failed. {e}')
+                return None
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def store(self, query: str, info: dict, keys: Tuple[str, ...],
+              expires_at: float) -> None:
+        """Saves the given keys of a video's info, reachable from both the
+        query that found it and its own page URL.
+        """
+        now = time.time()
+        video_id = info['id']
+        queries = {query, info.get('webpage_url')} - {None}
+        saved = {key: info.get(key) for key in keys + ('id',)}
+        with self._lock:
+            try:
+                with self.conn:
+                    self.conn.execute(
+                        'INSERT OR REPLACE INTO songs VALUES (?, ?, ?, ?)',
+                        (video_id, json.dumps(saved), now, expires_at)
+                    )
+                    self.conn.executemany(
+                        'INSERT OR REPLACE INTO queries VALUES (?, ?, ?)',
+                        ((q, video_id, now) for q in queries)
+                    )
+            except sqlite3.Error as e:
+                print(f'Warning: Could not save {video_id} to song cache. {e}')
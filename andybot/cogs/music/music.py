@@ -1,6 +1,6 @@
 import asyncio
 from collections import defaultdict
-from typing import Tuple, Union
+from typing import Callable, Iterable, List, Tuple, Union
 
 import discord
 import yt_dlp
@@ -8,25 +8,62 @@ from discord.ext import commands
 
 from andybot.core.andybot import Andybot, handle_base_exceptions
 from andybot.core.checks import in_voice_call, in_voice_call_check, \
-    is_playing_audio, is_playing_audio_check
+    is_playing_audio_check
 from andybot.core.misc import escape_special_chars
-from andybot.cogs.music.utils import Playlist, YouTubeSong
+from andybot.cogs.music.player import GuildPlayer
+from andybot.cogs.music.sources import PreloadedSource, passes_through
+from andybot.cogs.music.utils import Playlist, Song, SongError, \
+    YouTubeSong, is_playlist
 
-FFMPEG_OPTS = '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5'
+# How many songs from a playlist get resolved at once
+PLAYLIST_CONCURRENCY = 3
+# Reactions for flipping to the previous and next page of a list
+PAGE_EMOJIS = ('\u25c0', '\u25b6')
+# How many seconds a list keeps listening for page flips
+PAGE_TIMEOUT = 120
 
 
 class GuildMusicState:
     """Helper class to track a single guild's state."""
 
     def __init__(self) -> None:
+        self.preloaded = None
+        self.preload_timer = None
         self.reset()
 
     def reset(self) -> None:
+        self.clear_preload()
         self.playlist = Playlist()
         self.volume = 0.1
         self.voice = None
         self.now_playing = None
 
+    def clear_preload(self) -> None:
+        """Cancels any scheduled preload and gets rid of the preloaded
+        source, if there is one.
+        """
+        if self.preload_timer is not None:
+            self.preload_timer.cancel()
+            self.preload_timer = None
+        if self.preloaded is not None:
+            self.preloaded[1].cleanup()
+            self.preloaded = None
+
+    def take_preloaded(self, song: Song, volume: float
+                       ) -> Union[PreloadedSource, None]:
+        """Gets the preloaded source if it's for the given song. A preloaded
+        source for any other song, or one with an outdated volume baked in,
+        is thrown away.
+        """
+        source = None
+        if self.preloaded is not None and self.preloaded[0] is song:
+            preloaded_source, preloaded_volume = self.preloaded[1:]
+            if not preloaded_source.is_opus() or preloaded_volume == volume:
+                source = preloaded_source
+                self.preloaded = None
+        self.clear_preload()
+        return source
+
 
 class Music(commands.Cog):
     """Cog for playing music in voice call."""
@@ -34,11 +71,24 @@ class Music(commands.Cog):
     def __init__(self, bot: discord.Client) -> None:
         self.bot = bot
         self.states = defaultdict(GuildMusicState)
+        self.players = {}
+
+    def cog_unload(self) -> None:
+        for player in self.players.values():
+            player.stop()
 
     def get_state(self, ctx: commands.Context) -> GuildMusicState:
         """Gets the state for a given guild."""
         return self.states[ctx.guild.id]
 
+    def get_player(self, ctx: commands.Context) -> GuildPlayer:
+        """Gets the player for a given guild."""
+        if ctx.guild.id not in self.players:
+            self.players[ctx.guild.id] = GuildPlayer(
+                self.bot, ctx.guild, self.get_state(ctx)
+            )
+        return self.players[ctx.guild.id]
+
     def get_voice_client(self, ctx: commands.Context) -> discord.VoiceClient:
         return ctx.guild.voice_client
 
@@ -52,8 +102,8 @@ class Music(commands.Cog):
 
     @commands.command(aliases=['add', 'p', '+'])
     async def play(self, ctx: commands.Context, *, url: str) -> None:
-        """Attempts to play the given URL. Currently does not support any
-        other arguments.
+        """Attempts to play the given URL or search. Playlist URLs queue
+        every song in the playlist that fits.
         """
         state = self.get_state(ctx)
         song = YouTubeSong(url, ctx.author)
@@ -63,12 +113,83 @@ class Music(commands.Cog):
             await channel.connect()
             await ctx.guild.change_voice_state(channel=channel, self_deaf=True)
 
-        state.playlist.add_song(song)
+        message = await ctx.send(
+            f'Resolving **{escape_special_chars(url)}**...'
+        )
+        try:
+            # Nothing is awaited between queueing the song and starting its
+            # lookup, and the lookup goes through the song, so the player
+            # joins it instead of starting its own
+            state.playlist.add_song(song)
+            info = await song.resolve(self.bot.loop, allow_playlist=True)
+        except Exception:
+            if song in state.playlist:
+                state.playlist.remove(song)
+            await message.delete()
+            raise
+
+        if is_playlist(info):
+            await self._queue_playlist(ctx, song, info, message)
+            return
+
         escaped_title = escape_special_chars(song.title)
-        await ctx.send(f'Added **{escaped_title}** to queue.')
+        await message.edit(content=f'Added **{escaped_title}** to queue.')
+        self.get_player(ctx).wake(ctx.channel)
+
+    async def _queue_playlist(self, ctx: commands.Context,
+                              placeholder: YouTubeSong, info: dict,
+                              message: discord.Message) -> None:
+        """Swaps a playlist's placeholder song for the playlist's entries.
+        Playback can start as soon as the first one is resolved while the
+        rest get resolved in the background.
+        """
+        state = self.get_state(ctx)
+        entries = [entry for entry in info['entries'] if entry]
+        queued = placeholder in state.playlist
+        room = state.playlist.room + queued  # The placeholder's spot
+        if not queued and self.get_player(ctx).current is placeholder:
+            # The placeholder already started playing the first song
+            entries = entries[1:]
+        # Otherwise it was skipped or removed before the playlist came
+        # back, so every song still gets queued
+        songs = [YouTubeSong.from_playlist_entry(entry, ctx.author)
+                 for entry in entries[:room]]
+        if queued:
+            state.playlist.replace_song(placeholder, songs)
+        else:
+            state.playlist.add_songs(songs)
+
+        title = escape_special_chars(info.get('title') or 'playlist')
+        content = f'Added **{len(songs)}** songs from **{title}** to queue.'
+        if len(entries) > len(songs):
+            content += (
+                f" {len(entries) - len(songs)} didn't fit in the queue."
+            )
+        await message.edit(content=content)
+
+        if songs:
+            self.get_player(ctx).wake(ctx.channel)
+        self.bot.loop.create_task(self._resolve_songs(state, songs))
+
+    async def _resolve_songs(self, state: GuildMusicState,
+                             songs: Iterable[YouTubeSong]) -> None:
+        """Resolves songs in queue order, a few at a time. Songs that can't
+        be resolved are taken out of the queue.
+        """
+        limit = asyncio.Semaphore(PLAYLIST_CONCURRENCY)
+
+        async def resolve(song: YouTubeSong) -> None:
+            async with limit:
+                if song not in state.playlist:
+                    return
+                try:
+                    await song.resolve(self.bot.loop)
+                except (SongError, yt_dlp.DownloadError) as e:
+                    print(f'Warning: Could not resolve {song.title}. {e}')
+                    if song in state.playlist:
+                        state.playlist.remove(song)
 
-        if not is_playing_audio(ctx):
-            self._play(ctx)
+        await asyncio.gather(*(resolve(song) for song in songs))
 
     @play.error
     async def play_error(self, ctx: commands.Context, error: Exception):
@@ -115,11 +236,65 @@ class Music(commands.Cog):
         else:
             raise commands.CommandError('Bot is not in a voice channel.')
 
+    @commands.check(in_voice_call_check)
+    @commands.command(aliases=['lookup'])
+    async def find(self, ctx: commands.Context, *, song_search: str) -> None:
+        """Lists the songs in the queue best matching a search, best
+        first.
+        """
+        state = self.get_state(ctx)
+        matches = state.playlist.rank_playlist(song_search)
+        if not matches:
+            await ctx.send(f'Could not find "{song_search}" in the queue.')
+            return
+        embed = discord.Embed(
+            title=f'Songs matching "{song_search}"',
+            description='\n'.join(
+                f'{state.playlist.index(song) + 1:03d}. {song.title}'
+                for song, _ in matches
+            )
+        )
+        Andybot.embed(embed)
+        await ctx.send(embed=embed)
+
+    @commands.check(in_voice_call_check)
+    @commands.command(aliases=['mv'])
+    async def movesong(self, ctx: commands.Context, position: int, *,
+                       song_search: str) -> None:
+        """Moves a song (by name) to a position in the queue, starting at
+        1.
+        """
+        state = self.get_state(ctx)
+        if position < 1:
+            raise commands.CommandError('Queue positions start at 1.')
+        song = state.playlist.move_song(song_search, position - 1)
+        await ctx.send(
+            f'Moved **{escape_special_chars(song.title)}** to position '
+            f'{state.playlist.index(song) + 1}.'
+        )
+
+    @commands.check(in_voice_call_check)
+    @commands.command(aliases=['rm', 'delete', '-'])
+    async def remove(self, ctx: commands.Context, *, song_search: str
+                     ) -> None:
+        """Removes a song from the queue by name."""
+        state = self.get_state(ctx)
+        state.playlist.del_song(song_search)
+
+    @commands.check(in_voice_call_check)
+    @commands.command(aliases=['mix'])
+    async def shuffle(self, ctx: commands.Context) -> None:
+        """Shuffles the queue."""
+        state = self.get_state(ctx)
+        state.playlist.shuffle()
+        await ctx.send('Shuffled the queue.')
+
     @commands.check(in_voice_call_check)
     @commands.command(aliases=['leave', 'die', 'begone', 'farethewell'])
     async def stop(self, ctx: commands.Context) -> None:
         """Stops the music and disconnects the bot from the voice call."""
         voice, state = self.get_voice_info(ctx)
+        self.get_player(ctx).stop()
         await voice.disconnect()
         state.reset()
 
@@ -136,58 +311,99 @@ class Music(commands.Cog):
 
         vol /= 100
         state.volume = vol
-        ctx.guild.voice_client.source.volume = vol
+        source = ctx.guild.voice_client.source
+        song = state.now_playing
+        if isinstance(source, discord.PCMVolumeTransformer):
+            source.volume = vol
+        elif source is not None and song is not None and \
+                passes_through(song.acodec, vol):
+            await ctx.send(
+                'This song is passed straight through, so the volume only '
+                "applies to songs that aren't already Opus."
+            )
+        elif source is not None:
+            # ffmpeg applies the volume itself, which can't change mid-song
+            await ctx.send('The new volume will kick in on the next song.')
 
     @commands.check(in_voice_call_check)
     @commands.command(aliases=['songs', 'q'])
-    async def queue(self, ctx: commands.Context) -> None:
-        """Lists the current songs in the queue."""
+    async def queue(self, ctx: commands.Context, page: int = 1) -> None:
+        """Lists the current songs in the queue, a page at a time."""
         state = self.get_state(ctx)
-        embed = discord.Embed(
-            title=f'Now playing: {state.now_playing.title}',
-            description=state.playlist.song_list
+        now_playing = state.now_playing.title if state.now_playing else 'none'
+        await self._send_pages(
+            ctx, f'Now playing: {now_playing}',
+            lambda: state.playlist.song_list_pages, page
         )
-        Andybot.embed(embed)
-        await ctx.send(embed=embed)
 
     @commands.check(in_voice_call_check)
     @commands.command(aliases=['h'])
-    async def history(self, ctx: commands.Context) -> None:
-        """Lists the song history. Most recent songs are at the top."""
+    async def history(self, ctx: commands.Context, page: int = 1) -> None:
+        """Lists the song history, a page at a time. Most recent songs are
+        at the top.
+        """
         state = self.get_state(ctx)
+        await self._send_pages(
+            ctx, 'Song history (most recent listed first)',
+            lambda: state.playlist.history_pages, page
+        )
+
+    @commands.command(aliases=['playerstats'])
+    async def musicstats(self, ctx: commands.Context) -> None:
+        """Shows how the music player has been doing in this server."""
         embed = discord.Embed(
-            title='Song history (most recent listed first)',
-            description=state.playlist.history
+            title='Music player stats',
+            description=self.get_player(ctx).summary()
         )
         Andybot.embed(embed)
         await ctx.send(embed=embed)
 
-    def _play(self, ctx: commands.Context) -> None:
-        """Handles the actual playing of the song.
-
-        TODO: Currently experiences some pretty choppy audio at times. Seems
-        to be pretty intermittent, so might just be my wifi/Discord at home
-        being bad (since I'm running this bot from home).
+    async def _send_pages(self, ctx: commands.Context, title: str,
+                          get_pages: Callable[[], List[str]],
+                          page: int) -> None:
+        """Sends one page of a list as an embed, with reactions for flipping
+        through the rest. Pages are fetched again on every flip (they're
+        cached by the playlist) so they stay up to date.
         """
-        voice, state = self.get_voice_info(ctx)
-        song = state.playlist.get_song()
-        source = discord.PCMVolumeTransformer(
-            discord.FFmpegPCMAudio(song.url, before_options=FFMPEG_OPTS),
-            volume=state.volume
-        )
-        state.now_playing = song
-        asyncio.run_coroutine_threadsafe(
-            ctx.send(embed=song.embed(state.playlist.next_song)), self.bot.loop
-        )
-
-        def after(error: Exception) -> None:
-            if state.playlist.is_empty():
-                voice.stop()
-            else:
-                self._play(ctx)
-
-        voice.play(source, after=after)
-
+        pages = get_pages()
+        index = min(max(page, 1), len(pages)) - 1
+
+        def page_embed() -> discord.Embed:
+            embed = discord.Embed(title=title, description=pages[index])
+            embed.set_footer(text=f'Page {index + 1}/{len(pages)}')
+            return Andybot.embed(embed)
+
+        message = await ctx.send(embed=page_embed())
+        if len(pages) == 1:
+            return
+        for emoji in PAGE_EMOJIS:
+            await message.add_reaction(emoji)
+
+        def check(reaction: discord.Reaction, user: discord.User) -> bool:
+            return (reaction.message.id == message.id
+                    and str(reaction.emoji) in PAGE_EMOJIS
+                    and user != self.bot.user)
+
+        while True:
+            try:
+                reaction, user = await self.bot.wait_for(
+                    'reaction_add', timeout=PAGE_TIMEOUT, check=check
+                )
+            except asyncio.TimeoutError:
+                break
+            step = 1 if str(reaction.emoji) == PAGE_EMOJIS[1] else -1
+            pages = get_pages()
+            index = (index + step) % len(pages)
+            await message.edit(embed=page_embed())
+            try:
+                await message.remove_reaction(reaction.emoji, user)
+            except discord.Forbidden:
+                pass
+
+        try:
+            await message.clear_reactions()
+        except discord.Forbidden:
+            pass
 
 def setup(client: discord.Client) -> None:
     client.add_cog(Music(client))
@@ -0,0 +1,235 @@
+import asyncio
+from collections import deque
+from typing import TYPE_CHECKING, Union
+
+import discord
+import yt_dlp
+
+from andybot.core.misc import escape_special_chars
+from andybot.cogs.music.sources import PreloadedSource, create_source, \
+    with_volume
+from andybot.cogs.music.utils import Song, SongError
+
+if TYPE_CHECKING:
+    from andybot.cogs.music.music import GuildMusicState
+
+# How many seconds before the end of a song the next one starts preloading
+PRELOAD_AHEAD = 15
+# How many upcoming songs get their stream URLs refreshed ahead of time
+REFRESH_LOOKAHEAD = 3
+# How long the bot sits in a voice channel with nothing to play before
+# leaving
+IDLE_TIMEOUT = 5 * 60
+# Longest a song gets to start (resolving, refreshing its stream URL and
+# starting ffmpeg) before it's skipped
+START_TIMEOUT = 45
+# How many guilds can be starting a song at once, so a burst of guilds
+# finishing songs together doesn't pile up yt-dlp lookups
+MAX_CONCURRENT_STARTS = 4
+# How many recent transition times are kept for the stats
+TRANSITIONS_KEPT = 50
+
+
+class GuildPlayer:
+    """Plays one guild's queue from a single task on the event loop.
+
+    The task waits for songs to be queued, plays them one at a time and
+    waits for each to finish. discord's audio thread only ever sets an event
+    when a song ends, so all of the scheduling happens on the event loop.
+    The player leaves the voice channel after IDLE_TIMEOUT seconds with
+    nothing to play, and keeps track of how long transitions between songs
+    take and how many songs failed.
+    """
+
+    _start_limit = None
+
+    def __init__(self, bot: discord.Client, guild: discord.Guild,
+                 state: 'GuildMusicState') -> None:
+        self.bot = bot
+        self.guild = guild
+        self.state = state
+        self.channel = None
+        # The song being started or played, if any
+        self.current = None
+        self.songs_played = 0
+        self.errors = 0
+        self.idle_disconnects = 0
+        self.transition_times = deque(maxlen=TRANSITIONS_KEPT)
+        self._queued = asyncio.Event()
+        self._finished = asyncio.Event()
+        self._task = None
+
+    @classmethod
+    def start_limit(cls) -> asyncio.Semaphore:
+        # Made on first use so it belongs to the running event loop
+        if cls._start_limit is None:
+            cls._start_limit = asyncio.Semaphore(MAX_CONCURRENT_STARTS)
+        return cls._start_limit
+
+    @property
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    @property
+    def voice(self) -> Union[discord.VoiceClient, None]:
+        return self.guild.voice_client
+
+    def wake(self, channel: discord.abc.Messageable = None) -> None:
+        """Lets the player know there's something to play, starting it if
+        it isn't running. Messages go to channel from now on if it's given.
+        """
+        if channel is not None:
+            self.channel = channel
+        self._queued.set()
+        if not self.is_running:
+            self._task = self.bot.loop.create_task(self._run())
+
+    def stop(self) -> None:
+        if self.is_running:
+            self._task.cancel()
+        self._task = None
+
+    def summary(self) -> str:
+        times = self.transition_times
+        average = sum(times) / len(times) if times else 0
+        return (
+            f'Songs played: {self.songs_played}\n'
+            f'Songs that failed: {self.errors}\n'
+            f'Average transition: {average:.2f} s\n'
+            f'Slowest recent transition: {max(times, default=0):.2f} s\n'
+            f'Idle disconnects: {self.idle_disconnects}'
+        )
+
+    async def _send(self, *args, **kwargs) -> None:
+        if self.channel is None:
+            return
+        try:
+            await self.channel.send(*args, **kwargs)
+        except discord.HTTPException as e:
+            print(f'Warning: Could not send to {self.channel}. {e}')
+
+    async def _run(self) -> None:
+        while self.voice is not None and self.voice.is_connected():
+            if self.state.playlist.is_empty():
+                self._queued.clear()
+                try:
+                    await asyncio.wait_for(self._queued.wait(), IDLE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    await self._leave_idle()
+                    return
+                continue
+            try:
+                await self._play_next()
+            except Exception as e:
+                # One bad song shouldn't take the whole player down
+                self.errors += 1
+                print(f'Warning: Player for {self.guild} hit an error. {e!r}')
+                if self.voice is not None and self.voice.is_playing():
+                    await self._finished.wait()
+
+    async def _leave_idle(self) -> None:
+        self.idle_disconnects += 1
+        if self.voice is not None:
+            await self.voice.disconnect()
+        self.state.reset()
+        await self._send(
+            f'Left the voice channel after {IDLE_TIMEOUT // 60} minutes '
+            'with nothing to play.'
+        )
+
+    async def _play_next(self) -> None:
+        """Starts the next song in the queue and waits for it to end. Songs
+        that can't be started in time are skipped.
+        """
+        started_at = self.bot.loop.time()
+        state = self.state
+        song = self.current = state.playlist.get_song()
+        try:
+            await self._play(song, started_at)
+        finally:
+            self.current = None
+
+    async def _play(self, song: Song, started_at: float) -> None:
+        state = self.state
+        try:
+            async with self.start_limit():
+                source = await asyncio.wait_for(
+                    self._start_source(song), START_TIMEOUT
+                )
+        except (SongError, yt_dlp.DownloadError, asyncio.TimeoutError):
+            self.errors += 1
+            await self._send(
+                f"Couldn't download **{escape_special_chars(song.title)}**, "
+                'skipping it.'
+            )
+            return
+
+        voice = self.voice
+        if voice is None or not voice.is_connected():
+            source.cleanup()
+            return
+        self._finished.clear()
+        voice.play(source, after=self._after)
+        self.transition_times.append(self.bot.loop.time() - started_at)
+        self.songs_played += 1
+        state.now_playing = song
+
+        self.bot.loop.create_task(
+            self._refresh_upcoming(song.duration or 0)
+        )
+        state.preload_timer = self.bot.loop.call_later(
+            max(0, (song.duration or 0) - PRELOAD_AHEAD), self._preload_next
+        )
+        await self._send(embed=song.embed(state.playlist.next_song))
+        await self._finished.wait()
+
+    def _after(self, error: Union[Exception, None]) -> None:
+        # Runs on discord's audio thread
+        if error is not None:
+            self.errors += 1
+            print(f'Warning: Playback failed. {error}')
+        self.bot.loop.call_soon_threadsafe(self._finished.set)
+
+    async def _start_source(self, song: Song) -> discord.AudioSource:
+        """Resolves a song if it's still being looked up and gets its audio
+        source ready.
+        """
+        state = self.state
+        await song.resolve(self.bot.loop)
+        if song.expires_within(song.duration or 0):
+            # The background refresh didn't get to this one in time
+            await song.resolve(self.bot.loop, refresh=True)
+        source = state.take_preloaded(song, state.volume) or \
+            self._make_source(song)
+        return with_volume(source, state.volume)
+
+    def _make_source(self, song: Song) -> discord.AudioSource:
+        return create_source(song.url, self.state.volume, song.acodec)
+
+    def _preload_next(self) -> None:
+        """Starts ffmpeg for the next song and buffers its first few seconds
+        while the current song is still playing, so the switch between songs
+        doesn't have to wait on ffmpeg.
+        """
+        state = self.state
+        state.preload_timer = None
+        song = state.playlist.next_song
+        if song is None or not song.is_resolved or \
+                song.expires_within(PRELOAD_AHEAD + (song.duration or 0)):
+            return
+        state.clear_preload()
+        state.preloaded = (
+            song, PreloadedSource(self._make_source(song)), state.volume
+        )
+
+    async def _refresh_upcoming(self, lead_time: float) -> None:
+        """Gets new stream URLs for upcoming songs whose URLs would expire
+        before they're done playing, so starting them never has to wait on
+        yt-dlp.
+        """
+        for song in self.state.playlist.expiring_songs(lead_time,
+                                                       REFRESH_LOOKAHEAD):
+            try:
+                await song.resolve(self.bot.loop, refresh=True)
+            except (SongError, yt_dlp.DownloadError) as e:
+                print(f'Warning: Could not refresh {song.title}. {e}')
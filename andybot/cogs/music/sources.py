@@ -0,0 +1,147 @@
+import threading
+from collections import deque
+
+import discord
+
+from andybot.core.file import cfg
+
+# Discord audio frames are 20 ms each
+FRAMES_PER_SECOND = 50
+PRELOAD_SECONDS = 3
+
+FFMPEG_RECONNECT_OPTS = (
+    '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5'
+)
+# Audio settings, all overridable from the "audio" section of config.json.
+# In opus mode ffmpeg applies the volume and encodes the Opus packets itself,
+# so Python never touches the audio. pcm mode is the old way, where ffmpeg
+# decodes to PCM and the volume and encoding happen in Python, which costs a
+# lot more CPU but lets the volume change mid-song.
+AUDIO_DEFAULTS = {
+    'mode': 'opus',
+    # Opus bitrate in kbps. Discord voice channels top out at 96 without
+    # boosts, but 128 doesn't hurt.
+    'bitrate': 128,
+    # How much of the stream (bytes) and how long (microseconds) ffmpeg
+    # looks at to figure out the format. YouTube's streams are always the
+    # same few formats, so the defaults (5 MB and 5 s) are overkill.
+    'probe_size': 32768,
+    'analyze_duration': 500000,
+    # How many packets ffmpeg can buffer from the stream before it has to
+    # wait on encoding, which smooths over network hiccups
+    'thread_queue_size': 1024,
+    # In opus mode, streams that are already Opus (most of YouTube's) get
+    # copied straight through to Discord without decoding or re-encoding,
+    # which is the cheapest way to play anything. Discord gets the packets
+    # as they are though, so there's no way to change their volume, and the
+    # volume setting only applies to other streams. Off by default since the
+    # default volume is well below the streams' own.
+    'passthrough': False,
+}
+audio_cfg = {**AUDIO_DEFAULTS, **cfg.get('audio', {})}
+
+
+def ffmpeg_before_options() -> str:
+    return (
+        f'{FFMPEG_RECONNECT_OPTS} '
+        f'-probesize {audio_cfg["probe_size"]} '
+        f'-analyzeduration {audio_cfg["analyze_duration"]} '
+        f'-thread_queue_size {audio_cfg["thread_queue_size"]}'
+    )
+
+
+def passes_through(codec: str, volume: float) -> bool:
+    """Whether a stream gets copied to Discord as is. That's Opus streams
+    in opus mode, either with passthrough on (ignoring the volume) or when
+    the volume is exactly 100.
+    """
+    return audio_cfg['mode'] != 'pcm' and codec == 'opus' and \
+        (audio_cfg['passthrough'] or volume == 1.0)
+
+
+def create_source(url: str, volume: float, codec: str = None
+                  ) -> discord.AudioSource:
+    """Makes an ffmpeg audio source for a stream URL. In opus mode, ffmpeg
+    bakes the volume in with an audio filter and encodes to Opus, unless
+    passes_through says the stream can be copied as is, in which case the
+    volume isn't applied at all. In pcm mode the volume is left to
+    with_volume.
+    """
+    before_options = ffmpeg_before_options()
+    if audio_cfg['mode'] == 'pcm':
+        return discord.FFmpegPCMAudio(url, before_options=before_options)
+    if passes_through(codec, volume):
+        return discord.FFmpegOpusAudio(
+            url, codec='copy', before_options=before_options
+        )
+    return discord.FFmpegOpusAudio(
+        url, bitrate=audio_cfg['bitrate'], before_options=before_options,
+        options=f'-filter:a volume={volume}'
+    )
+
+
+def with_volume(source: discord.AudioSource, volume: float
+                ) -> discord.AudioSource:
+    """Lets a PCM source's volume be changed while it plays. Opus sources
+    already have their volume baked in by ffmpeg, so they're left alone.
+    """
+    if source.is_opus():
+        return source
+    return discord.PCMVolumeTransformer(source, volume=volume)
+
+
+class PreloadedSource(discord.AudioSource):
+    """Wraps an audio source and reads its first few seconds ahead of time
+    on a background thread, so by the time the source starts playing, ffmpeg
+    has already started up, connected and filled a buffer.
+
+    Buffered frames are handed out first. The wrapped source is only read
+    directly once the preloading thread is finished with it, so it's never
+    read from two threads at once.
+    """
+
+    def __init__(self, source: discord.AudioSource,
+                 seconds: float = PRELOAD_SECONDS) -> None:
+        self.source = source
+        self._frames = deque()
+        self._num_frames = int(seconds * FRAMES_PER_SECOND)
+        self._ended = False
+        self._cancelled = False
+        self._preloaded = threading.Event()
+        self._thread = threading.Thread(target=self._preload, daemon=True)
+        self._thread.start()
+
+    def _preload(self) -> None:
+        try:
+            for _ in range(self._num_frames):
+                if self._cancelled:
+                    break
+                frame = self.source.read()
+                if not frame:
+                    self._ended = True
+                    break
+                self._frames.append(frame)
+        finally:
+            self._preloaded.set()
+
+    @property
+    def buffered_seconds(self) -> float:
+        return len(self._frames) / FRAMES_PER_SECOND
+
+    def read(self) -> bytes:
+        if self._frames:
+            return self._frames.popleft()
+        self._preloaded.wait()
+        if self._frames:
+            return self._frames.popleft()
+        return b'' if self._ended else self.source.read()
+
+    def is_opus(self) -> bool:
+        return self.source.is_opus()
+
+    def cleanup(self) -> None:
+        self._cancelled = True
+        # Cleaning up the wrapped source kills ffmpeg, which also unblocks
+        # the preloading thread if it's stuck waiting on a read
+        self.source.cleanup()
+        self._frames.clear()
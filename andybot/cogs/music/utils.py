@@ -1,18 +1,25 @@
+import asyncio
+import heapq
 import pytz
-import random
-from collections import deque
+import time
+from collections import Counter, deque
 from datetime import datetime
-from typing import Any, Iterable, Union
+from itertools import islice
+from typing import Any, Callable, Iterable, List, Tuple, Union
+from urllib.parse import parse_qs, urlsplit
 
 import discord
 import yt_dlp
 
+from andybot.cogs.music.cache import SongCache
 from andybot.core.andybot import Andybot
-from andybot.core.fuzzy_string import lcs_length
+from andybot.core.fuzzy_string import NgramIndex, lcs_length
+from andybot.core.indexed_list import IndexedList
 
 YT_DLP_OPTS = {
     'default_search': 'ytsearch',
-    'format': 'bestaudio/best',
+    # Opus streams can go straight to Discord without being re-encoded
+    'format': 'bestaudio[acodec=opus]/bestaudio/best',
     'extract_flat': 'in_playlist',
     'noplaylist': True,
 }
@@ -23,9 +30,29 @@ KEYS_TO_SAVE = (
     'thumbnail',
     'duration',
     'webpage_url',
-    'description',
+    'acodec',
 )
 
+# Fallback lifetime of a stream URL when it doesn't say when it expires.
+# googlevideo URLs carry an expire= timestamp, usually about 6 hours out.
+STREAM_URL_TTL = 5 * 60 * 60
+# How long before a stream URL expires it should be treated as expired, so
+# ffmpeg never has to reconnect to a dead URL mid-song
+STREAM_URL_MARGIN = 10 * 60
+
+# How many songs each guild's queue can hold
+QUEUE_LEN = 5000
+# How many played songs each guild's history keeps
+HISTORY_LEN = 100
+# Discord's limit on the length of an embed's description
+EMBED_DESCRIPTION_LIMIT = 2048
+# Most songs listed on one page of the queue or history
+SONGS_PER_PAGE = 20
+# Longest a single song's line can get before it's cut off
+MAX_LINE_LEN = 150
+
+song_cache = SongCache()
+
 QUALITIES = {
     'low': 1,
     'medium': 2,
@@ -47,25 +74,179 @@ class NoSongFoundError(SongError):
 
 class Song:
     """Base class for all songs."""
+    __slots__ = ()
+
+
+def stream_url_expiry(url: str, resolved_at: float) -> float:
+    """Gets the UNIX time a stream URL stops working."""
+    try:
+        return float(parse_qs(urlsplit(url).query)['expire'][0])
+    except (KeyError, IndexError, ValueError):
+        return resolved_at + STREAM_URL_TTL
+
+
+def is_url(query: str) -> bool:
+    return urlsplit(query).scheme in ('http', 'https')
+
+
+def is_playlist(info: dict) -> bool:
+    return 'entries' in info
+
+
+def extract_info(query: str, allow_playlist: bool = False,
+                 use_cache: bool = True) -> dict:
+    """Runs yt-dlp on a URL or search query. This blocks for as long as
+    yt-dlp takes, so it should only ever be called from an executor.
+
+    If allow_playlist is True and query is a playlist URL, the playlist is
+    returned as is, with flat entries that still need to be resolved.
+
+    Songs seen before come out of the song cache instead. If the cached
+    stream URL won't last through the song, only the search is skipped and
+    the video itself gets extracted again. use_cache=False always does a
+    fresh extraction (but still saves it).
+    """
+    lookup = query
+    if use_cache:
+        cached = song_cache.lookup(query)
+        if cached is not None:
+            info, expires_at = cached
+            lasts_until = time.time() + (info.get('duration') or 0)
+            if expires_at - STREAM_URL_MARGIN > lasts_until:
+                return info
+            lookup = info.get('webpage_url') or query
+
+    from_playlist_url = False
+    with yt_dlp.YoutubeDL(YT_DLP_OPTS) as ydl:
+        info = ydl.extract_info(lookup, download=False)
+        if info is not None and is_playlist(info) and \
+                not (allow_playlist and is_url(lookup)):
+            # Searches come back as a playlist of (flat) results
+            from_playlist_url = is_url(lookup)
+            info = next(iter(info['entries']), None)
+            if info is not None and \
+                    info.get('_type') in ('url', 'url_transparent'):
+                info = ydl.extract_info(info['url'], download=False)
+    if info is None:
+        raise NoSongInfoError('The requested URL has no information.')
+
+    # A playlist URL cut down to its first video is only cached under that
+    # video's own URL, or a later lookup that allows playlists would get
+    # the one video back instead of the playlist
+    key = info.get('webpage_url') if from_playlist_url else query
+    if not is_playlist(info) and info.get('id') and key:
+        expires_at = stream_url_expiry(info['url'], time.time())
+        song_cache.store(key, info, KEYS_TO_SAVE, expires_at)
+    return info
 
 
 class YouTubeSong(Song):
     """yt-dlp helper class that downloads video information and stores it
     in class attributes for easy use.
+
+    Creating a song is instant; the yt-dlp lookup only happens once resolve
+    is awaited, and runs in an executor so it doesn't block the event loop.
+    Until then, title is the URL or search the song was requested with,
+    unless a better one (like a playlist entry's) is given.
+
+    Only the handful of fields the bot uses are kept, never the whole
+    yt-dlp extraction, since songs stick around in the history.
     """
-    # TODO: Implement more robust way of getting stream link so playlists
-    # can be queued
-
-    def __init__(self, url: str, requester: discord.User = None) -> None:
-        info = None
-        with yt_dlp.YoutubeDL(YT_DLP_OPTS) as ydl:
-            info = ydl.extract_info(url, download=False)
-        if info is None:
-            raise NoSongInfoError('The requested URL has no information.')
+    __slots__ = KEYS_TO_SAVE + (
+        'query', 'requester', 'resolved_at', 'expires_at', '_resolving'
+    )
+
+    def __init__(self, url: str, requester: discord.User = None,
+                 title: str = None, duration: int = None) -> None:
         for key in KEYS_TO_SAVE:
-            setattr(self, key, info[key])
+            setattr(self, key, None)
+        self.query = url
+        self.title = title or url
+        self.duration = duration
         self.requester = requester
-        self._all_info = info
+        self.resolved_at = None
+        self.expires_at = None
+        self._resolving = None
+
+    @classmethod
+    def from_playlist_entry(cls, entry: dict, requester: discord.User = None
+                            ) -> 'YouTubeSong':
+        """Makes an unresolved song out of a flat playlist entry."""
+        return cls(entry.get('url') or entry['id'], requester,
+                   entry.get('title'), entry.get('duration'))
+
+    @property
+    def is_resolved(self) -> bool:
+        return self.resolved_at is not None
+
+    def expires_within(self, seconds: float) -> bool:
+        """Checks whether the stream URL will stop working (give or take
+        STREAM_URL_MARGIN) in the next however many seconds.
+        """
+        if not self.is_resolved:
+            return False
+        return self.expires_at - STREAM_URL_MARGIN < time.time() + seconds
+
+    async def resolve(self, loop: asyncio.AbstractEventLoop = None,
+                      refresh: bool = False, allow_playlist: bool = False
+                      ) -> Union[dict, None]:
+        """Looks up the song's information with yt-dlp and returns what it
+        found, or None if the song was already resolved. Safe to await from
+        several places at once, the lookup only happens once. If refresh is
+        True, a resolved song is looked up again to get a fresh stream URL.
+
+        If allow_playlist is True and the song is a playlist URL, the
+        playlist's info comes back as is and the song stands in for the
+        playlist's first entry, which still needs resolving. Anyone else
+        waiting on that lookup goes on to resolve the entry.
+        """
+        if self._resolving is None:
+            if self.is_resolved and not refresh:
+                return None
+            loop = loop or asyncio.get_event_loop()
+            # Refreshes go straight to the video so a search can't change
+            # which video this song is
+            self._resolving = loop.run_in_executor(
+                None, extract_info, self.webpage_url or self.query,
+                allow_playlist and not refresh, not refresh
+            )
+        resolving = self._resolving
+        try:
+            info = await asyncio.shield(resolving)
+        except Exception:
+            # Let the next caller try again
+            if self._resolving is resolving:
+                self._resolving = None
+            raise
+        # Whoever gets here first fills the song in and lets go of the
+        # lookup (and the info it holds on to)
+        if self._resolving is resolving:
+            self._resolving = None
+            if is_playlist(info):
+                self.set_first_entry(info)
+            else:
+                self.set_info(info)
+        if is_playlist(info) and not allow_playlist:
+            # This caller needs an actual song, not the playlist
+            await self.resolve(loop)
+        return info
+
+    def set_first_entry(self, info: dict) -> None:
+        """Turns the song into an unresolved song for a playlist's first
+        entry.
+        """
+        entry = next((entry for entry in info['entries'] if entry), None)
+        if entry is not None:
+            self.query = entry.get('url') or entry['id']
+            self.title = entry.get('title') or self.query
+            self.duration = entry.get('duration')
+
+    def set_info(self, info: dict) -> None:
+        """Fills in the song from a yt-dlp extraction."""
+        for key in KEYS_TO_SAVE:
+            setattr(self, key, info.get(key))
+        self.resolved_at = time.time()
+        self.expires_at = stream_url_expiry(self.url, self.resolved_at)
 
     def embed(self, next_song: Song) -> discord.Embed:
         """Creates an embed with information about the song and the next
@@ -88,12 +269,174 @@ class YouTubeSong(Song):
         return Andybot.embed(embed)
 
 
-class Playlist(deque):
-    """A simple FIFO queue used for queueing songs. Has a max length of 100."""
+def paginate(lines: Iterable[str], header: str,
+             per_page: int = SONGS_PER_PAGE,
+             limit: int = EMBED_DESCRIPTION_LIMIT) -> List[str]:
+    """Splits lines up into pages of at most per_page lines, each starting
+    with header and short enough to fit in an embed's description.
+    """
+    pages = []
+    page_lines = []
+    page_len = len(header)
+    for line in lines:
+        if len(line) > MAX_LINE_LEN:
+            line = line[:MAX_LINE_LEN - 3] + '...'
+        if page_lines and (len(page_lines) == per_page
+                           or page_len + len(line) + 1 > limit):
+            pages.append('\n'.join([header] + page_lines))
+            page_lines = []
+            page_len = len(header)
+        page_lines.append(line)
+        page_len += len(line) + 1
+    if page_lines:
+        pages.append('\n'.join([header] + page_lines))
+    return pages
+
+
+def normalize_title(title: str) -> str:
+    """Yells a title (so the lcs function knows exactly what we're talking
+    about) and squashes its whitespace.
+    """
+    return ' '.join(title.upper().split())
+
+
+class TitleIndex:
+    """Searchable index of song titles. Titles are normalized, broken into
+    n-grams and have their characters counted once, when a song is added.
+    A search tries the songs sharing the most n-grams with it first, so good
+    matches turn up early, and skips any song whose character counts show it
+    can't match as well as the ones found so far. That gives the same
+    results as running the lcs function on every song, without doing so.
+
+    A song's title can change when it gets resolved, so unresolved songs are
+    kept track of and re-indexed right before the next search if they did.
+    version goes up whenever any title is added, removed or changed, so
+    anything built from the titles can tell when it's out of date.
+    """
+
+    def __init__(self) -> None:
+        self.version = 0
+        self._titles = NgramIndex()
+        self._char_counts = {}
+        self._unresolved = set()
+
+    def __len__(self) -> int:
+        return len(self._titles)
+
+    def _index(self, song: Song, title: str) -> None:
+        self._titles.add(song, title)
+        self._char_counts[song] = Counter(title)
+
+    def add(self, song: Song) -> None:
+        self._index(song, normalize_title(song.title))
+        if not song.is_resolved:
+            self._unresolved.add(song)
+        self.version += 1
+
+    def discard(self, song: Song) -> None:
+        self._titles.discard(song)
+        self._char_counts.pop(song, None)
+        self._unresolved.discard(song)
+        self.version += 1
+
+    def clear(self) -> None:
+        self._titles = NgramIndex()
+        self._char_counts.clear()
+        self._unresolved.clear()
+        self.version += 1
+
+    def refresh(self) -> bool:
+        """Re-indexes songs whose title changed since they were added.
+        Returns whether any did.
+        """
+        changed = False
+        for song in list(self._unresolved):
+            title = normalize_title(song.title)
+            if title != self._titles.text(song):
+                self._index(song, title)
+                self.version += 1
+                changed = True
+            if song.is_resolved:
+                self._unresolved.discard(song)
+        return changed
+
+    def search(self, song_name: str, k: int = 1,
+               position: Callable[[Song], int] = None
+               ) -> List[Tuple[Song, int]]:
+        """Finds the (at most k) songs best matching a search as (song,
+        subsequence length) pairs, best first. Ties go to the song that
+        comes first by position if it's given.
+        """
+        if k < 1:
+            return []
+        self.refresh()
+        song_search = normalize_title(song_name)
+        search_counts = Counter(song_search)
+
+        # Minimum required subsequence--if none of our songs match at least
+        # as good as this, we assume it's not in the list
+        min_len = len(song_search) * 0.8
+
+        shared = [song for song, _ in self._titles.candidates(song_search)]
+        rest = self._char_counts.keys() - set(shared)
+        matches = []
+        # Min-heap of the k best subsequence lengths so far
+        best = []
+        for song in shared + list(rest):
+            cutoff = max(min_len, best[0]) if len(best) == k else min_len
+            # Every character of a common subsequence is in both strings,
+            # so it can't be longer than the characters they have in common
+            char_bound = sum((search_counts & self._char_counts[song])
+                             .values())
+            if char_bound < cutoff:
+                continue
+            subseq_len = lcs_length(
+                song_search, self._titles.text(song), cutoff
+            )
+            if subseq_len and subseq_len >= cutoff:
+                matches.append((song, subseq_len))
+                if len(best) < k:
+                    heapq.heappush(best, subseq_len)
+                else:
+                    heapq.heappushpop(best, subseq_len)
+
+        if position is None:
+            # Stable, so ties stay in n-gram order
+            matches.sort(key=lambda match: match[1], reverse=True)
+        else:
+            matches.sort(key=lambda match: (-match[1], position(match[0])))
+        return matches[:k]
+
+
+class Playlist(IndexedList):
+    """A FIFO queue used for queueing songs. Has a max length of QUEUE_LEN.
+    Since it's an IndexedList, getting, deleting or moving a song anywhere
+    in the queue only takes O(log n). Only the last HISTORY_LEN played songs
+    are remembered.
+    """
 
     def __init__(self, iterable: Iterable = ()) -> None:
-        self.song_history = []
-        super(Playlist, self).__init__(iterable=iterable, maxlen=100)
+        self.maxlen = QUEUE_LEN
+        self.song_history = deque(maxlen=HISTORY_LEN)
+        self.queue_titles = TitleIndex()
+        self.history_titles = TitleIndex()
+        # Rendered pages along with the title index version they're from
+        self._queue_pages = (None, [])
+        self._history_pages = (None, [])
+        super(Playlist, self).__init__(iterable)
+
+    def _track(self, node) -> None:
+        super(Playlist, self)._track(node)
+        self.queue_titles.add(node.item)
+
+    def _untrack(self, node) -> None:
+        super(Playlist, self)._untrack(node)
+        if node.item not in self:
+            self.queue_titles.discard(node.item)
+
+    def clear(self) -> None:
+        super(Playlist, self).clear()
+        self.queue_titles.clear()
 
     @property
     def next_song(self) -> Union[Any, None]:
@@ -102,26 +445,58 @@ class Playlist(deque):
         """
         return self[0] if not self.is_empty() else None
 
+    @property
+    def history_pages(self) -> List[str]:
+        """The song history as pages of a list, most recent first."""
+        self.history_titles.refresh()
+        version, pages = self._history_pages
+        if version != self.history_titles.version:
+            pages = paginate(
+                (song.title for song in reversed(self.song_history)),
+                'History:'
+            ) or ['No song history yet.']
+            self._history_pages = (self.history_titles.version, pages)
+        return pages
+
+    @property
+    def song_list_pages(self) -> List[str]:
+        """The queue as pages of a numbered list."""
+        self.queue_titles.refresh()
+        version, pages = self._queue_pages
+        if version != self.queue_titles.version:
+            pages = paginate(
+                (f'{i + 1:03d}. {song.title}' for i, song in enumerate(self)),
+                'Current queue:'
+            ) or ['No songs in queue yet.']
+            self._queue_pages = (self.queue_titles.version, pages)
+        return pages
+
     @property
     def history(self) -> str:
-        """Property that returns the song history as a numbered list."""
-        if self.song_history:
-            return 'History:\n' + '\n'.join(
-                song.title for song in reversed(self.song_history)
-            )
-        else:
-            return 'No song history yet.'
+        """Property that returns the first page of the song history."""
+        return self.history_pages[0]
 
     @property
     def song_list(self) -> str:
-        """Property that returns the queue as a numbered list."""
-        numbered_queue = []
-        for i, song in enumerate(self):
-            numbered_queue.append(f'{i + 1:03d}. {song.title}')
-        if numbered_queue:
-            return 'Current queue:\n' + '\n'.join(numbered_queue)
-        else:
-            return 'No songs in queue yet.'
+        """Property that returns the first page of the queue as a numbered
+        list.
+        """
+        return self.song_list_pages[0]
+
+    def expiring_songs(self, lead_time: float, lookahead: int
+                       ) -> List[Song]:
+        """Gets the songs among the next few whose stream URL will expire
+        before they finish playing, assuming the next song starts in
+        lead_time seconds and the rest play back to back after it.
+        """
+        expiring = []
+        starts_in = lead_time
+        for song in islice(self, lookahead):
+            finishes_in = starts_in + (song.duration or 0)
+            if song.expires_within(finishes_in):
+                expiring.append(song)
+            starts_in = finishes_in
+        return expiring
 
     def is_empty(self) -> bool:
         """Checks whether the playlist is empty."""
@@ -136,6 +511,36 @@ class Playlist(deque):
         else:
             raise IndexError('Queue max length reached.')
 
+    @property
+    def room(self) -> int:
+        """How many more songs fit in the queue."""
+        return self.maxlen - self.__len__()
+
+    def replace_song(self, song: Song, songs: Iterable[Song]) -> None:
+        """Swaps a song in the queue for several others, in the same spot.
+        Raises IndexError if they don't all fit.
+        """
+        songs = list(songs)
+        if len(songs) - 1 > self.room:
+            raise IndexError('Queue max length reached.')
+        index = self.index(song)
+        del self[index]
+        for offset, new_song in enumerate(songs):
+            self.insert(index + offset, new_song)
+
+    def move_song(self, song_name: str, position: int) -> Song:
+        """Moves a song (found by name) to a position in the queue, indexed
+        from 0.
+        """
+        found_index = self.search_playlist(song_name)
+        if found_index is None:
+            raise NoSongFoundError(
+                f'Could not find "{song_name}" in the queue.'
+            )
+        song = self[found_index]
+        self.move(found_index, position)
+        return song
+
     def add_songs(self, songs: Iterable) -> None:
         """Adds multiple songs to the right of the Playlist."""
         for song in songs:
@@ -146,7 +551,10 @@ class Playlist(deque):
         intended to be a FIFO queue.
         """
         song = self.popleft()
+        if len(self.song_history) == self.song_history.maxlen:
+            self.history_titles.discard(self.song_history[0])
         self.song_history.append(song)
+        self.history_titles.add(song)
         return song
 
     def del_song(self, song_name: str) -> None:
@@ -163,9 +571,10 @@ class Playlist(deque):
         """Skips ahead by a number of songs."""
         if num_songs < 0:
             raise ValueError('Number of songs to skip must be positive or 0.')
+        if num_songs > len(self):
+            raise IndexError('Cannot skip past the end of the queue.')
 
-        for _ in range(num_songs):
-            self.popleft()
+        del self[:num_songs]
 
     def skip_to(self, song_name: str) -> None:
         """Skips to a song by name."""
@@ -179,51 +588,36 @@ class Playlist(deque):
 
     def search_playlist(self, song_name: str) -> Union[int, None]:
         """Finds the index (indexed from 0) of a song in the playlist."""
-        return self.search_song_list(song_name, self)
+        matches = self.rank_playlist(song_name, 1)
+        return self.index(matches[0][0]) if matches else None
+
+    def rank_playlist(self, song_name: str, k: int = 5
+                      ) -> List[Tuple[Song, int]]:
+        """Finds the (at most k) songs in the queue best matching a search
+        as (song, subsequence length) pairs, best first.
+        """
+        if self.is_empty():
+            raise IndexError('Cannot search an empty song list.')
+        return self.queue_titles.search(song_name, k, self.index)
 
     def search_history(self, song_name: str) -> Union[Song, None]:
-        """Finds the index (indexed from 0) of a song in the playlist."""
-        found_index = self.search_song_list(song_name, self.song_history)
-        if found_index is not None:
-            return self.song_history[found_index]
+        """Finds a song in the history by name."""
+        if not self.song_history:
+            raise IndexError('Cannot search an empty song list.')
+        matches = self.history_titles.search(
+            song_name, 1, self.song_history.index
+        )
+        if matches:
+            return matches[0][0]
         else:
             raise NoSongFoundError(
-                f'Could not find "{song_name}" in the queue.'
+                f'Could not find "{song_name}" in the history.'
             )
 
-    def search_song_list(self, song_name: str, song_list: Iterable[Song]
-                         ) -> Union[int, None]:
-        """Finds the index (indexed from 0) of a song in the playlist."""
-        if len(song_list) == 0:
-            raise IndexError('Cannot search an empty song list.')
-
-        # Minimum required subsequence--if none of our songs match at least
-        # as good as this, we assume it's not in the playlist
-        min_len = len(song_name) * 0.8
-
-        # Make sure we yell the song name so the lcs function knows
-        # exactly what we're talking about
-        song_search = song_name.upper()
-
-        # Default is none for no match
-        best_match_index = None
-
-        # Finds index of most similar song
-        longest_subseq = 0
-        for index, song in enumerate(song_list):
-            subseq_len = lcs_length(song.title.upper(), song_search)
-            if subseq_len >= min_len and longest_subseq < subseq_len:
-                longest_subseq = subseq_len
-                best_match_index = index
-
-        return best_match_index
-
     def shuffle(self) -> None:
-        """Shuffles the playlist. Since Python implements a deque as a
-        doubly-linked list, shuffling a deque itself is incredibly
-        slow (in terms of computer time, at least--it still only takes like
-        6 ms for a 1000-item deque lol) because they have O(n) random access
-        time. However, this should really only become a problem with long
-        queues, which this playlist won't allow.
+        """Shuffles the playlist. This used to be a random.shuffle over a
+        deque, which has O(n) random access, so O(n^2) overall. Now the
+        queue's tree just gets rebuilt in a random order in O(n).
         """
-        random.shuffle(self)
+        super(Playlist, self).shuffle()
+        self._queue_pages = (None, [])
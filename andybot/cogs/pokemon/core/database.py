@@ -0,0 +1,104 @@
+import os.path as osp
+import sqlite3
+from typing import List, Union
+
+DB_PATH = './data/pkmn.db'
+SCHEMA_PATH = './data/pkmn_db.sql'
+
+# Same order as PokeAPI's type ids, so a column's position is also its index
+# in the pokeapi TYPES_MAP
+TYPE_COLUMNS = (
+    'normal', 'fighting', 'flying', 'poison', 'ground', 'rock', 'bug',
+    'ghost', 'steel', 'fire', 'water', 'grass', 'electric', 'psychic', 'ice',
+    'dragon', 'dark', 'fairy',
+)
+STAT_COLUMNS = ('hp', 'atk', 'def', 'spa', 'spd', 'spe')
+
+
+class PokemonDB:
+    """Read-only query layer over the local Pokemon database built by
+    andybot.cogs.pokemon.core.ingest. Every lookup returns None when the
+    database (or the row) doesn't exist so callers can fall back to PokeAPI.
+    """
+
+    def __init__(self, path: str = DB_PATH) -> None:
+        self.path = path
+        self._conn = None
+
+    @property
+    def conn(self) -> Union[sqlite3.Connection, None]:
+        if self._conn is None and osp.isfile(self.path):
+            self._conn = sqlite3.connect(
+                f'file:{self.path}?mode=ro', uri=True,
+                check_same_thread=False
+            )
+            self._conn.row_factory = sqlite3.Row
+        return self._conn
+
+    def _fetch_one(self, query: str, *args) -> Union[sqlite3.Row, None]:
+        if self.conn is None:
+            return None
+        try:
+            return self.conn.execute(query, args).fetchone()
+        except sqlite3.Error as e:
+            print(f'Warning: Pokemon database query failed. {e}')
+            return None
+
+    def get_form(self, pokemon: str) -> Union[sqlite3.Row, None]:
+        return self._fetch_one(
+            'SELECT * FROM PokemonForms WHERE form_name = ?', pokemon
+        )
+
+    def get_species(self, species: str) -> Union[sqlite3.Row, None]:
+        return self._fetch_one(
+            'SELECT * FROM PokemonSpecies WHERE name = ?', species
+        )
+
+    def get_types(self, pokemon: str) -> Union[List[str], None]:
+        form = self.get_form(pokemon)
+        return None if form is None else [form['type_1'], form['type_2']]
+
+    def get_abilities(self, pokemon: str) -> Union[List[str], None]:
+        form = self.get_form(pokemon)
+        if form is None:
+            return None
+        return [form['ability_1'], form['ability_2'], form['hidden_ability']]
+
+    def get_stats(self, pokemon: str) -> Union[List[int], None]:
+        form = self.get_form(pokemon)
+        if form is None:
+            return None
+        return [form[stat] for stat in STAT_COLUMNS]
+
+    def get_type_dmg_from(self, type_: str) -> Union[List[float], None]:
+        row = self._fetch_one(
+            'SELECT * FROM TypeDamageFrom WHERE type = ?', type_
+        )
+        return None if row is None else [row[col] for col in TYPE_COLUMNS]
+
+    def get_type_dmg_to(self, type_: str) -> Union[List[float], None]:
+        row = self._fetch_one(
+            'SELECT * FROM TypeDamageTo WHERE type = ?', type_
+        )
+        return None if row is None else [row[col] for col in TYPE_COLUMNS]
+
+    def get_all_type_dmg_from(self) -> Union[List[List[float]], None]:
+        """Gets the damage every type takes, in TYPE_COLUMNS order."""
+        if self.conn is None:
+            return None
+        try:
+            rows = self.conn.execute('SELECT * FROM TypeDamageFrom')
+            dmg_from = {
+                row['type']: [row[col] for col in TYPE_COLUMNS] for row in rows
+            }
+        except sqlite3.Error as e:
+            print(f'Warning: Pokemon database query failed. {e}')
+            return None
+        if any(type_ not in dmg_from for type_ in TYPE_COLUMNS):
+            return None
+        return [dmg_from[type_] for type_ in TYPE_COLUMNS]
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
@@ -0,0 +1,190 @@
+"""Builds the local Pokemon database from PokeAPI.
+
+Usage: python -m andybot.cogs.pokemon.core.ingest [--dump DIR] [--db PATH]
+
+Without --dump everything is fetched from PokeAPI (through the same cached
+session the cog uses). With --dump, resources are read from a local copy of
+PokeAPI's api-data repo instead, where every URL path maps to
+<DIR>/<path>/index.json.
+"""
+import argparse
+import asyncio
+import json
+import os
+import os.path as osp
+import sqlite3
+from typing import Awaitable, Callable, Iterable, List
+from urllib.parse import urlsplit
+
+import andybot.cogs.pokemon.core.pokeapi as pokeapi
+from andybot.cogs.pokemon.core.database import DB_PATH, SCHEMA_PATH, \
+    STAT_COLUMNS, TYPE_COLUMNS
+from andybot.cogs.pokemon.core.records import PokemonRecord, TypeRecord
+
+API_URL = 'https://pokeapi.co/api/v2'
+MAX_CONCURRENT = 16
+INDEXES = (
+    'CREATE INDEX IF NOT EXISTS FormsBySpecies '
+    'ON PokemonForms (species_name)',
+)
+
+Fetcher = Callable[[str], Awaitable[dict]]
+
+
+def dump_fetcher(dump_dir: str) -> Fetcher:
+    """Makes a fetcher that reads resources out of an api-data dump."""
+    async def fetch(url: str) -> dict:
+        path = urlsplit(url).path.strip('/')
+        with open(osp.join(dump_dir, path, 'index.json'), 'rb') as file:
+            return json.load(file)
+    return fetch
+
+
+def resource_id(url: str) -> int:
+    return int(url.rstrip('/').split('/')[-1])
+
+
+async def fetch_all(fetch: Fetcher, urls: Iterable[str],
+                    max_concurrent: int = MAX_CONCURRENT) -> List[dict]:
+    limit = asyncio.Semaphore(max_concurrent)
+
+    async def limited_fetch(url: str) -> dict:
+        async with limit:
+            return await fetch(url)
+
+    return await asyncio.gather(*(limited_fetch(url) for url in urls))
+
+
+def final_evos(chain: dict) -> set:
+    """Gets the names of every species in an evolution chain that doesn't
+    evolve any further.
+    """
+    finals = set()
+    all_evos = [chain['chain']]
+    while all_evos:
+        cur_evo = all_evos.pop()
+        if not cur_evo['evolves_to']:
+            finals.add(cur_evo['species']['name'])
+        all_evos.extend(cur_evo['evolves_to'])
+    return finals
+
+
+def type_rows(types: List[TypeRecord], direction: str) -> List[tuple]:
+    """Turns type records into TypeDamageTo or TypeDamageFrom rows."""
+    return [(type_.name, *getattr(type_, f'dmg_{direction}'))
+            for type_ in types]
+
+
+def form_row(pokemon: PokemonRecord, species_name: str,
+             fully_evolved: bool, is_default: bool) -> tuple:
+    return (
+        species_name, pokemon.name, int(not is_default), int(fully_evolved),
+        *pokemon.types, *pokemon.abilities, sum(pokemon.stats),
+        *pokemon.stats, None
+    )
+
+
+async def ingest(db_path: str = DB_PATH, schema_path: str = SCHEMA_PATH,
+                 fetch: Fetcher = pokeapi.get_by_url) -> None:
+    """Builds the whole database in a temporary file and swaps it in at the
+    end, so a running bot never sees a half-built database.
+    """
+    tmp_path = f'{db_path}.tmp'
+    if osp.isfile(tmp_path):
+        os.remove(tmp_path)
+
+    type_list = (await fetch(f'{API_URL}/type'))['results']
+    types = [TypeRecord.from_resource(type_) for type_ in await fetch_all(
+        fetch,
+        (type_['url'] for type_ in type_list if type_['name'] in TYPE_COLUMNS)
+    )]
+    print(f'Got {len(types)} types.')
+
+    species_list = (
+        await fetch(f'{API_URL}/pokemon-species?limit=10000')
+    )['results']
+    species = await fetch_all(fetch, (s['url'] for s in species_list))
+    print(f'Got {len(species)} species.')
+
+    chain_urls = {s['evolution_chain']['url'] for s in species
+                  if s['evolution_chain']}
+    finals = set()
+    for chain in await fetch_all(fetch, chain_urls):
+        finals |= final_evos(chain)
+    print(f'Got {len(chain_urls)} evolution chains.')
+
+    variety_urls, variety_species = [], []
+    for s in species:
+        for variety in s['varieties']:
+            variety_urls.append(variety['pokemon']['url'])
+            variety_species.append(s['name'])
+    forms = await fetch_all(fetch, variety_urls)
+    print(f'Got {len(forms)} forms.')
+
+    conn = sqlite3.connect(tmp_path)
+    with open(schema_path, 'r', encoding='utf-8') as file:
+        conn.executescript(file.read())
+    for index in INDEXES:
+        conn.execute(index)
+
+    with conn:
+        conn.executemany(
+            'INSERT INTO PokemonSpecies VALUES (?, ?, ?, ?, ?, ?)',
+            (
+                (
+                    s['name'], s['id'], resource_id(s['generation']['url']),
+                    int(s['is_legendary']), int(s['is_mythical']),
+                    int(s['name'] in finals)
+                ) for s in species
+            )
+        )
+        columns = ', '.join(TYPE_COLUMNS)
+        placeholders = ', '.join('?' * (len(TYPE_COLUMNS) + 1))
+        for table, direction in (('TypeDamageTo', 'to'),
+                                 ('TypeDamageFrom', 'from')):
+            conn.executemany(
+                f'INSERT INTO {table} (type, {columns}) '
+                f'VALUES ({placeholders})',
+                type_rows(types, direction)
+            )
+        conn.executemany(
+            'INSERT OR REPLACE INTO PokemonForms (species_name, form_name, '
+            'is_alt_form, is_viable, type_1, type_2, ability_1, ability_2, '
+            f'hidden_ability, bst, {", ".join(STAT_COLUMNS)}, speed_rank) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (
+                form_row(
+                    PokemonRecord.from_resource(form), species_name,
+                    species_name in finals, form['is_default']
+                ) for form, species_name in zip(forms, variety_species)
+            )
+        )
+        # Fraction of all forms that are strictly slower
+        conn.execute(
+            'UPDATE PokemonForms SET speed_rank = ('
+            'SELECT COUNT(*) FROM PokemonForms AS other '
+            'WHERE other.spe < PokemonForms.spe'
+            ') * 1.0 / (SELECT COUNT(*) FROM PokemonForms)'
+        )
+    conn.close()
+
+    os.replace(tmp_path, db_path)
+    print(f'Saved Pokemon database to {db_path}.')
+
+
+async def main(args: argparse.Namespace) -> None:
+    fetch = dump_fetcher(args.dump) if args.dump else pokeapi.get_by_url
+    try:
+        await ingest(args.db, args.schema, fetch)
+    finally:
+        await pokeapi.session.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Builds the local Pokemon database from PokeAPI.'
+    )
+    parser.add_argument('--dump', help='path to a local api-data dump')
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--schema', default=SCHEMA_PATH)
+    asyncio.run(main(parser.parse_args()))
@@ -1,6 +1,8 @@
+import os.path as osp
 import random
+import threading
 from math import floor, ceil
-from typing import List, Tuple, Union
+from typing import Iterator, List, NamedTuple, Optional, Tuple, Union
 
 import numpy as np
 
@@ -8,6 +10,22 @@ MIN_IVS = 0
 MAX_IVS = 31
 MIN_EVS = 0
 MAX_EVS = 252
+# Damage rolls are a random whole percent from 85 to 100
+MIN_ROLL = 85
+MAX_ROLL = 100
+NUM_ROLLS = MAX_ROLL - MIN_ROLL + 1
+# Defenders per batch in simulate_damage, which keeps memory flat no matter
+# how many samples are asked for
+SAMPLE_BATCH = 1 << 18
+# Nature modifiers for one stat, and which of them each of the 25 natures
+# has: 4 lower the stat, 17 don't touch it and 4 raise it
+NATURE_MODIFIERS = (0.9, 1.0, 1.1)
+NATURE_INDICES = np.repeat(np.arange(3, dtype=np.intp), (4, 17, 4))
+STAT_TABLE_PATH = './data/stat_table.npy'
+MAX_BASE = 255
+MAX_LEVEL = 100
+# How many values IV + EV // 4 can take
+NUM_STAT_OFFSETS = MAX_IVS + MAX_EVS // 4 + 1
 
 
 def poke_round(num: float) -> float:
@@ -30,7 +48,7 @@ def base_dmg(level: int, power: int, atk: int, def_: int) -> int:
     return floor(numerator / 50) + 2
 
 
-def random_dmg_array(level: int, power: int, atk: int, def_: int, other: int = 1,
+def calc_dmg(level: int, power: int, atk: int, def_: int, other: int = 1,
              random_num: float = 1.0) -> int:
     """Calculates the damage done from one Pokemon to another. random_num is
     a float in the range [0.85, 1] that defaults to 1 for maximum damage.
@@ -67,13 +85,13 @@ def calc_dmg_vector_random(level: int, power: int, atk: int,
 def highest_dmg(level: int, power: int, atk: int, def_: int, other: int = 1
                 ) -> int:
     """Calculates the highest damage roll based on the given inputs."""
-    return random_dmg_array(level, power, atk, def_, other, 1.0)
+    return calc_dmg(level, power, atk, def_, other, 1.0)
 
 
 def lowest_dmg(level: int, power: int, atk: int, def_: int, other: int = 1
                ) -> int:
-    """Calculates the highest damage roll based on the given inputs."""
-    return random_dmg_array(level, power, atk, def_, other, 0.85)
+    """Calculates the lowest damage roll based on the given inputs."""
+    return calc_dmg(level, power, atk, def_, other, 0.85)
 
 
 def random_nature() -> float:
@@ -115,81 +133,202 @@ def non_hp_stat(base: int, IV: int, EV: int, level: int,
 
 
 def hp_stat_extrema(base: int, level: int) -> Tuple[int, int]:
-    return (
-        hp_stat(base, MIN_IVS, MIN_EVS, level),
-        hp_stat(base, MAX_IVS, MAX_EVS, level)
-    )
+    stats = get_stat_table().hp(base, level)
+    return int(stats[0]), int(stats[-1])
 
 
 def non_hp_stat_extrema(base: int, level: int, nature: float = 1.0
                         ) -> Tuple[int, int]:
-    return (
-        non_hp_stat(base, MIN_IVS, MIN_EVS, level, nature),
-        non_hp_stat(base, MAX_IVS, MAX_EVS, level, nature)
-    )
+    stats = get_stat_table().non_hp(base, level, nature)
+    return int(stats[0]), int(stats[-1])
 
 
-def hp_stat_range(base: int, level: int) -> int:
+def hp_stat_range(base: int, level: int) -> np.ndarray:
     lowest_hp, highest_hp = hp_stat_extrema(base, level)
-    return list(range(lowest_hp, highest_hp + 1))
+    return np.arange(lowest_hp, highest_hp + 1)
 
 
-def non_hp_stat_range(base: int, level: int, nature: float = 1.0) -> int:
+def non_hp_stat_range(base: int, level: int, nature: float = 1.0
+                      ) -> np.ndarray:
     lowest_non_hp, highest_non_hp = non_hp_stat_extrema(base, level, nature)
-    return list(range(lowest_non_hp, highest_non_hp + 1))
+    return np.arange(lowest_non_hp, highest_non_hp + 1)
 
 
 def full_stat_ranges(bases: List[int], level: int, nature: float = 1.0
-                     ) -> List[int]:
-    stats = [hp_stat_extrema(bases[0], level)]
-    for base in bases[1:]:
-        stats.append(non_hp_stat_extrema(base, level, nature))
-    return stats
+                     ) -> np.ndarray:
+    """Gets the lowest and highest value of every stat as a (stats, 2)
+    array, HP first.
+    """
+    return get_stat_table().extrema(bases, level, nature)
 
 ###############################################################################
 ############################### Numpy versions ################################
 ###############################################################################
 
 
-def random_nature_array(size: int) -> np.ndarray:
-    """Creates an array of random natures modifiers for a single stat."""
-    # Each stat has 4 natures that lower by 0.9x, 17 that are neutral, and
-    # another 4 that raise by 1.1x
-    p = np.array((4, 17, 4)) / 25
-    natures = np.random.choice((0.9, 1.0, 1.1), size=size, p=p)
-    return natures
+class StatTable:
+    """Every stat any Pokemon can have, worked out ahead of time.
 
+    A table over every base, level, IV, EV // 4 and nature would be about
+    150 million entries, but the stat formula only ever looks at 2 x Base +
+    IV + EV // 4 as one number, which only goes up to 604. So the table is
+    just floor((2 x Base + IV + EV // 4) x Level / 100) for each of those
+    sums (rows) and each level (columns), about 60,000 entries. All the
+    stats of one base and level are then one slice of a column, rows 2 x
+    Base to 2 x Base + 94, and HP and natures are a cheap step on top.
+    """
 
-def random_ev_array(size: int) -> np.ndarray:
-    """Creates an array of random EVs."""
-    evs = np.random.randint(0, (252 // 4) + 1, size=size) * 4
-    return evs
+    def __init__(self, inner: np.ndarray) -> None:
+        self.inner = inner
+        # nature_stats[v, n] is v with the nth nature applied. The formula
+        # floors after the nature, so that's a lookup too.
+        values = np.arange(inner.max() + 6)
+        percents = np.rint(np.array(NATURE_MODIFIERS) * 100).astype(np.intp)
+        self._nature_stats = (
+            values[:, None] * percents // 100
+        ).astype(inner.dtype)
+
+    @classmethod
+    def build(cls) -> 'StatTable':
+        sums = np.arange(2 * MAX_BASE + NUM_STAT_OFFSETS)
+        levels = np.arange(MAX_LEVEL + 1)
+        return cls((sums[:, None] * levels // 100).astype(np.int16))
+
+    @classmethod
+    def load(cls, path: str = STAT_TABLE_PATH) -> Union['StatTable', None]:
+        """Loads a saved table, memory-mapped so it's only read in as it's
+        used.
+        """
+        if not osp.isfile(path):
+            return None
+        try:
+            inner = np.load(path, mmap_mode='r')
+        except (OSError, ValueError) as e:
+            print(f'Warning: Could not load stat table {path}. {e}')
+            return None
+        shape = (2 * MAX_BASE + NUM_STAT_OFFSETS, MAX_LEVEL + 1)
+        return cls(inner) if inner.shape == shape else None
+
+    def save(self, path: str = STAT_TABLE_PATH) -> None:
+        try:
+            np.save(path, self.inner)
+        except OSError as e:
+            print(f'Warning: Could not save stat table {path}. {e}')
+
+    def inner_stats(self, base: int, level: int) -> np.ndarray:
+        """Gets the inner part of the stat formula for every IV + EV // 4,
+        as a view into the table.
+        """
+        return self.inner[2 * base:2 * base + NUM_STAT_OFFSETS, level]
+
+    def hp(self, base: int, level: int) -> np.ndarray:
+        """Gets the HP stat for every IV + EV // 4."""
+        return self.inner_stats(base, level) + (level + 10)
+
+    def non_hp(self, base: int, level: int, nature: float = None
+               ) -> np.ndarray:
+        """Gets a non-HP stat for every IV + EV // 4. That's one column
+        with the given nature modifier, or one per nature modifier in
+        NATURE_MODIFIERS otherwise.
+        """
+        stats = self._nature_stats[self.inner_stats(base, level) + 5]
+        if nature is None:
+            return stats
+        return stats[:, NATURE_MODIFIERS.index(nature)]
+
+    def extrema(self, bases: List[int], level: int, nature: float = 1.0
+                ) -> np.ndarray:
+        """Gets the lowest and highest value of several stats at once as a
+        (stats, 2) array. The first base is taken to be HP.
+        """
+        sums = 2 * np.asarray(bases)[:, None] + [0, NUM_STAT_OFFSETS - 1]
+        inner = self.inner[sums, level]
+        stats = self._nature_stats[inner + 5,
+                                   NATURE_MODIFIERS.index(nature)]
+        stats[0] = inner[0] + level + 10
+        return stats
+
+
+_stat_table = None
+# Plots are rendered in several threads at once, and only one of them
+# should build and save the table
+_stat_table_lock = threading.Lock()
+
+
+def get_stat_table() -> StatTable:
+    """Gets the stat table, building it only once per process. It comes
+    from the saved table if there is one.
+    """
+    global _stat_table
+    if _stat_table is not None:
+        return _stat_table
 
+    with _stat_table_lock:
+        if _stat_table is None:
+            table = StatTable.load()
+            if table is None:
+                table = StatTable.build()
+                table.save()
+            _stat_table = table
+    return _stat_table
 
-def random_iv_array(size: int) -> np.ndarray:
-    """Creates an array of random IVs."""
-    ivs = np.random.randint(0, 31 + 1, size=size)
-    return ivs
 
+def _rng(rng: Optional[np.random.Generator]) -> np.random.Generator:
+    return rng if rng is not None else np.random.default_rng()
 
-def random_inner_stat_array(base: int, level: int, size: int) -> np.ndarray:
-    """Computes the inner part of the stat formula with random IVs and 0
-    EVs.
+
+def random_nature_array(size: int, rng: np.random.Generator = None
+                        ) -> np.ndarray:
+    """Creates an array of random natures modifiers for a single stat."""
+    natures = _rng(rng).integers(0, len(NATURE_INDICES), size=size)
+    return np.take(NATURE_MODIFIERS, NATURE_INDICES[natures])
+
+
+def random_ev_array(size: int, rng: np.random.Generator = None
+                    ) -> np.ndarray:
+    """Creates an array of random EVs. Only multiples of 4 count towards a
+    stat, so those are the only ones picked.
     """
-    random_ivs = random_iv_array(size)
-    return np.floor((2 * base + random_ivs) * level / 100)
+    return _rng(rng).integers(0, MAX_EVS // 4, size=size, endpoint=True) * 4
 
 
-def random_hp_array(base: int, level: int, size: int) -> np.ndarray:
-    """Creates an array of random values for a given stat. Assumes 0 EVs."""
-    base_stats = random_inner_stat_array(base, level, size)
-    return base_stats + level + 10
+def random_iv_array(size: int, rng: np.random.Generator = None
+                    ) -> np.ndarray:
+    """Creates an array of random IVs."""
+    return _rng(rng).integers(MIN_IVS, MAX_IVS, size=size, endpoint=True)
 
 
-def random_stat_array(base: int, level: int, size: int) -> np.ndarray:
-    """Creates an array of random values for a given stat. Assumes 0 EVs."""
-    natures = random_nature_array(size)
-    base_stats = random_inner_stat_array(base, level, size)
+def random_inner_stat_array(base: int, level: int, size: int,
+                            rng: np.random.Generator = None,
+                            evs: bool = False) -> np.ndarray:
+    """Computes the inner part of the stat formula with random IVs and,
+    if evs is True, random EVs (otherwise 0).
+    """
+    rng = _rng(rng)
+    inner = 2 * base + random_iv_array(size, rng)
+    if evs:
+        inner += random_ev_array(size, rng) // 4
+    return inner * level // 100
+
+
+def random_hp_array(base: int, level: int, size: int,
+                    rng: np.random.Generator = None,
+                    evs: bool = False) -> np.ndarray:
+    """Creates an array of random HP stats. Assumes 0 EVs unless evs is
+    True.
+    """
+    return random_inner_stat_array(base, level, size, rng, evs) + level + 10
+
+
+def random_stat_array(base: int, level: int, size: int,
+                      rng: np.random.Generator = None,
+                      evs: bool = False) -> np.ndarray:
+    """Creates an array of random values for a given stat. Assumes 0 EVs
+    unless evs is True.
+    """
+    rng = _rng(rng)
+    natures = random_nature_array(size, rng)
+    base_stats = random_inner_stat_array(base, level, size, rng, evs)
     return np.floor((base_stats + 5) * natures)
 
 
@@ -205,19 +344,285 @@ def base_dmg_array(level: int, power: int, atk: int,
     return np.floor(numerator / 50) + 2
 
 
+def random_roll_array(shape: Union[int, Tuple[int, ...]],
+                      rng: np.random.Generator = None) -> np.ndarray:
+    """Creates an array of random damage rolls as fractions in
+    [0.85, 1].
+    """
+    rolls = _rng(rng).integers(MIN_ROLL, MAX_ROLL, size=shape, endpoint=True)
+    return rolls / 100
+
+
 def random_dmg_array(level: int, power: int, atk: int, def_array: np.ndarray,
-                     other: float = 1.0) -> int:
-    """Calculates the damage done from one Pokemon to another. random_num is
-    a float in the range [0.85, 1] that defaults to 1 for maximum damage.
+                     other: float = 1.0, rng: np.random.Generator = None,
+                     hits: int = None) -> np.ndarray:
+    """Calculates the damage done from one Pokemon to another with a random
+    damage roll for each defense value. If hits is given, each defense value
+    gets that many independent rolls instead, as a (defenses, hits) array.
 
     Damage formula details: https://bulbapedia.bulbagarden.net/wiki/Damage
     """
-    array_size = def_array.shape[0]
     base = base_dmg_array(level, power, atk, def_array)
-    random_array = np.random.random_integers(85, 100, size=array_size) / 100
-    return np.floor(base * other * random_array)
+    if hits is None:
+        return np.floor(base * other * random_roll_array(base.shape, rng))
+    rolls = random_roll_array((base.shape[0], hits), rng)
+    return np.floor(base[:, None] * other * rolls)
 
 
 def damage_as_hp_percent(dmg_array: np.ndarray,
                          hp: Union[int, np.ndarray]) -> np.ndarray:
     return 100 * dmg_array / hp
+
+
+class DamageSamples(NamedTuple):
+    """One batch of simulated defenders and the damage they take."""
+    defense: np.ndarray
+    hp: np.ndarray
+    # (hits, defenders): each hit has its own damage roll
+    damage: np.ndarray
+
+
+class DamageSummary(NamedTuple):
+    """What a move's damage comes out to, in % of the defender's HP.
+    ko_chances[n] is the chance of a KO within n + 1 hits. Simulated
+    summaries have a sample count and seed, exact ones don't.
+    """
+    samples: int
+    seed: Optional[int]
+    min_percent: float
+    max_percent: float
+    mean_percent: float
+    ko_chances: Tuple[float, ...]
+    exact: bool = False
+
+    @property
+    def guaranteed_hits(self) -> Optional[int]:
+        """The fewest hits that always KO, if any of the simulated ones
+        do.
+        """
+        for hits, chance in enumerate(self.ko_chances, start=1):
+            if chance >= 1.0:
+                return hits
+        return None
+
+
+def stat_offset_weights() -> np.ndarray:
+    """Gets the chance of a random Pokemon having each IV + EV // 4, from 0
+    to 94. Every IV and every EV // 4 is equally likely, so this is just
+    the two uniform distributions convolved.
+    """
+    ivs = np.ones(MAX_IVS + 1)
+    evs = np.ones(MAX_EVS // 4 + 1)
+    return np.convolve(ivs, evs) / (ivs.size * evs.size)
+
+
+def hp_stat_table(base: int, level: int) -> np.ndarray:
+    """Gets the HP stat for every IV + EV // 4."""
+    return get_stat_table().hp(base, level)
+
+
+def non_hp_stat_table(base: int, level: int) -> np.ndarray:
+    """Gets a non-HP stat for every IV + EV // 4 (rows) and nature modifier
+    in NATURE_MODIFIERS (columns).
+    """
+    return get_stat_table().non_hp(base, level)
+
+
+def roll_dmg_table(level: int, power: int, atk: int, def_array: np.ndarray,
+                   other: float = 1.0) -> np.ndarray:
+    """Gets the damage for every defense (rows) and damage roll from 85 to
+    100 (columns).
+    """
+    rolls = np.arange(MIN_ROLL, MAX_ROLL + 1) / 100
+    return np.floor(
+        base_dmg_array(level, power, atk, def_array)[:, None] * other * rolls
+    ).astype(np.int32)
+
+
+def stat_distribution(table: np.ndarray, weights: np.ndarray
+                      ) -> Tuple[np.ndarray, np.ndarray]:
+    """Collapses a stat table and the chance of each of its cells down to
+    each distinct stat and its chance.
+    """
+    values, inverse = np.unique(table, return_inverse=True)
+    probs = np.bincount(inverse.ravel(), weights=weights.ravel(),
+                        minlength=values.size)
+    return values, probs
+
+
+def hp_distribution(base: int, level: int
+                    ) -> Tuple[np.ndarray, np.ndarray]:
+    """Gets every HP stat a random Pokemon can have and its chance."""
+    return stat_distribution(hp_stat_table(base, level),
+                             stat_offset_weights())
+
+
+def non_hp_distribution(base: int, level: int
+                        ) -> Tuple[np.ndarray, np.ndarray]:
+    """Gets every value a random Pokemon's non-HP stat can have (with a
+    random nature) and its chance.
+    """
+    nature_weights = np.bincount(NATURE_INDICES) / NATURE_INDICES.size
+    weights = stat_offset_weights()[:, None] * nature_weights
+    return stat_distribution(non_hp_stat_table(base, level), weights)
+
+
+def damage_distribution(level: int, power: int, atk: int, base_def: int,
+                        defender_level: int, other: float = 1.0
+                        ) -> Tuple[np.ndarray, np.ndarray]:
+    """Gets every damage number one hit can do to a random defender and its
+    exact chance.
+    """
+    defense, def_probs = non_hp_distribution(base_def, defender_level)
+    damage = roll_dmg_table(level, power, atk, defense, other)
+    weights = np.repeat(def_probs[:, None] / NUM_ROLLS, NUM_ROLLS, axis=1)
+    return stat_distribution(damage, weights)
+
+
+def exact_damage(level: int, power: int, atk: int, base_def: int,
+                 base_hp: int, defender_level: int, other: float = 1.0,
+                 max_hits: int = 4) -> DamageSummary:
+    """Works out exactly how much damage a move does and how likely it is
+    to KO within 1 to max_hits hits, over every IV, EV and nature a defender
+    can have and every damage roll of every hit.
+
+    Defense and HP only take a few hundred distinct values between them.
+    For each defense, the distribution of total damage after n hits is the
+    distribution after n - 1 hits shifted by each of the 16 rolls. Any
+    total past the highest HP is a KO no matter what, so totals are capped
+    there, which keeps every distribution tiny.
+    """
+    defense, def_probs = non_hp_distribution(base_def, defender_level)
+    hp, hp_probs = hp_distribution(base_hp, defender_level)
+    damage = roll_dmg_table(level, power, atk, defense, other)
+
+    # percent = 100 * damage / hp, with damage and hp independent
+    single_hit_mean = def_probs @ damage.mean(axis=1)
+    mean_percent = 100 * single_hit_mean * (hp_probs @ (1 / hp))
+    min_percent = 100 * damage.min() / hp.max()
+    max_percent = 100 * damage.max() / hp.min()
+
+    cap = int(hp.max())
+    num_defs = defense.size
+    # Where each total goes after one more hit, for every defense and roll
+    totals = np.arange(cap + 1)
+    targets = np.minimum(totals[None, None, :] + damage[:, :, None], cap)
+    targets += (np.arange(num_defs) * (cap + 1))[:, None, None]
+    targets = targets.ravel()
+
+    # dist[d, t]: chance the total so far is t (capped) given defense d
+    dist = np.zeros((num_defs, cap + 1))
+    dist[:, 0] = 1.0
+    ko_chances = []
+    for _ in range(max_hits):
+        weights = np.repeat(dist[:, None, :] / NUM_ROLLS, NUM_ROLLS, axis=1)
+        dist = np.bincount(
+            targets, weights=weights.ravel(), minlength=num_defs * (cap + 1)
+        ).reshape(num_defs, cap + 1)
+        # at_least[d, t]: chance the total is t or more given defense d
+        at_least = np.cumsum(dist[:, ::-1], axis=1)[:, ::-1]
+        chance = def_probs @ at_least[:, hp] @ hp_probs
+        # Rounded so floating point noise can't make a sure KO look unsure
+        ko_chances.append(round(min(max(float(chance), 0.0), 1.0), 12))
+
+    return DamageSummary(
+        samples=0,
+        seed=None,
+        min_percent=float(min_percent),
+        max_percent=float(max_percent),
+        mean_percent=float(mean_percent),
+        ko_chances=tuple(ko_chances),
+        exact=True,
+    )
+
+
+def sample_damage(level: int, power: int, atk: int, base_def: int,
+                  base_hp: int, defender_level: int, size: int,
+                  rng: np.random.Generator, other: float = 1.0,
+                  hits: int = 1) -> DamageSamples:
+    """Simulates a move hitting size random defenders (random IVs, EVs and
+    defense nature) hits times each, all in one vectorized pass.
+
+    IV + EV // 4 only has 95 possible values, so every possible stat and
+    every possible damage number is worked out once up front, and the
+    samples are just indices into those tables. IVs (32 values), EVs // 4
+    (64 values) and damage rolls (16 values) all come in powers of 2, so
+    they're all cut straight out of random bits.
+    """
+    hp_table = hp_stat_table(base_hp, defender_level)
+    def_table = non_hp_stat_table(base_def, defender_level).ravel()
+    dmg_table = roll_dmg_table(level, power, atk, def_table, other).ravel()
+
+    # Bytes 0-3 are the defense and HP IVs and EVs // 4 and every byte
+    # after that is two damage rolls
+    random_bytes = rng.bit_generator.random_raw(size).view(np.uint8) \
+        .reshape(size, 8)
+    def_offsets = (random_bytes[:, 0] & 31).astype(np.intp) \
+        + (random_bytes[:, 1] & 63)
+    hp = hp_table[(random_bytes[:, 2] & 31) + (random_bytes[:, 3] & 63)]
+    natures = NATURE_INDICES[rng.integers(0, len(NATURE_INDICES), size=size)]
+    def_index = (def_offsets * len(NATURE_MODIFIERS) + natures) * NUM_ROLLS
+
+    damage = np.empty((hits, size), dtype=np.int32)
+    roll_byte = 4
+    for hit in range(hits):
+        if roll_byte == 8:
+            random_bytes = rng.bit_generator.random_raw(size) \
+                .view(np.uint8).reshape(size, 8)
+            roll_byte = 0
+        rolls = random_bytes[:, roll_byte]
+        rolls = rolls & 15 if hit % 2 == 0 else rolls >> 4
+        damage[hit] = dmg_table[def_index + rolls]
+        roll_byte += hit % 2
+    return DamageSamples(def_table[def_index // NUM_ROLLS], hp, damage)
+
+
+def iter_damage_samples(level: int, power: int, atk: int, base_def: int,
+                        base_hp: int, defender_level: int, samples: int,
+                        rng: np.random.Generator, other: float = 1.0,
+                        hits: int = 1, batch: int = SAMPLE_BATCH
+                        ) -> Iterator[DamageSamples]:
+    """Simulates samples defenders in batches of at most batch."""
+    for start in range(0, samples, batch):
+        yield sample_damage(
+            level, power, atk, base_def, base_hp, defender_level,
+            min(batch, samples - start), rng, other, hits
+        )
+
+
+def simulate_damage(level: int, power: int, atk: int, base_def: int,
+                    base_hp: int, defender_level: int, other: float = 1.0,
+                    samples: int = 1_000_000, max_hits: int = 4,
+                    seed: int = None) -> DamageSummary:
+    """Monte Carlo estimate of how much damage a move does and how likely
+    it is to KO within 1 to max_hits hits, over random defender IVs, EVs
+    and natures and a random damage roll per hit. The same seed always gives
+    the same summary.
+    """
+    if samples < 1:
+        raise ValueError('Need at least 1 sample.')
+    rng = np.random.default_rng(seed)
+    kos = np.zeros(max_hits, dtype=np.int64)
+    min_percent, max_percent, percent_sum = np.inf, -np.inf, 0.0
+
+    for batch in iter_damage_samples(level, power, atk, base_def, base_hp,
+                                     defender_level, samples, rng, other,
+                                     max_hits):
+        # Single-hit damage uses the first roll of every defender
+        percent = damage_as_hp_percent(batch.damage[0], batch.hp)
+        min_percent = min(min_percent, percent.min())
+        max_percent = max(max_percent, percent.max())
+        percent_sum += percent.sum()
+        total_damage = np.zeros_like(batch.damage[0])
+        for hit, damage in enumerate(batch.damage):
+            total_damage += damage
+            kos[hit] += np.count_nonzero(total_damage >= batch.hp)
+
+    return DamageSummary(
+        samples=samples,
+        seed=seed,
+        min_percent=float(min_percent),
+        max_percent=float(max_percent),
+        mean_percent=float(percent_sum / samples),
+        ko_chances=tuple((kos / samples).tolist()),
+    )
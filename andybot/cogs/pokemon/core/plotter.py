@@ -1,30 +1,142 @@
-import matplotlib.pyplot as plt
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import TYPE_CHECKING, Tuple
 
-import andybot.cogs.pokemon.core.math as pokemath
+from andybot.core.cache import LRUCache
 
+if TYPE_CHECKING:
+    from matplotlib.axes import Axes
+    from matplotlib.collections import PathCollection
+    from matplotlib.figure import Figure
 
-def damage_scatter(attacker_level: int, defender_level: int, power: int,
-                   atk: int, base_def: int, stab: bool, type_: float,
-                   mods: float, base_hp: int) -> None:
-    """Creates a simple 2D graph of the possible damage done to a defending
-    Pokemon.
-    """
-    fig, ax = plt.subplots(figsize=(5, 2.7), layout='constrained')
-    samples = 250
-    def_vec = pokemath.random_stat_array(base_def, defender_level, samples)
-    total_mods = (1.5 if stab else 1) * type_ * mods
-    dmgs = pokemath.random_dmg_array(attacker_level, power, atk, def_vec,
-                                     total_mods)
-    hps = pokemath.random_hp_array(base_hp, defender_level, samples)
-    hp_percent = pokemath.damage_as_hp_percent(dmgs, hps)
-    ax.scatter(def_vec, hp_percent, label='Damages', alpha=0.5)
+# numpy and matplotlib are only imported inside the functions that render,
+# so loading the cog never pays for them
+
+# How many random defenders a damage plot shows
+PLOT_SAMPLES = 500
+# Worker threads rendering plots, so rendering never blocks the bot
+PLOT_WORKERS = 2
+# How many rendered plots are kept around
+PLOT_CACHE_SIZE = 64
+
+# Each worker thread keeps its own figure around and redraws it, since
+# setting up a figure costs more than drawing the points on it. Figures
+# aren't thread-safe, so they are never shared between threads.
+_local = threading.local()
+
+
+def _get_scatter_template() -> Tuple['Figure', 'Axes', 'PathCollection']:
+    template = getattr(_local, 'scatter_template', None)
+    if template is not None:
+        return template
+
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(5, 2.7), layout='constrained')
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    points = ax.scatter([], [], label='Damages', alpha=0.5)
+    ax.axhline(100, color='tab:red', linestyle='--', label='KO')
     ax.set_xlabel('Defense')
     ax.set_ylabel('Damage (as % of hp)')
-    ax.set_title(f'Random damage calculation with {samples} samples')
     ax.legend()
-    plt.grid()
-    plt.savefig('./attachments/damage_scatter.png')
+    ax.grid()
+    _local.scatter_template = (fig, ax, points)
+    return _local.scatter_template
+
+
+def render_damage_scatter(attacker_level: int, defender_level: int,
+                          power: int, atk: int, base_def: int, base_hp: int,
+                          mods: float, samples: int = PLOT_SAMPLES,
+                          seed: int = 0) -> bytes:
+    """Plots the damage a move does to random defenders against their
+    defense and returns it as a PNG. The same seed always gives the same
+    plot.
+    """
+    import numpy as np
+
+    import andybot.cogs.pokemon.core.math as pokemath
+
+    batch = pokemath.sample_damage(
+        attacker_level, power, atk, base_def, base_hp, defender_level,
+        samples, np.random.default_rng(seed), mods
+    )
+    hp_percent = pokemath.damage_as_hp_percent(batch.damage[0], batch.hp)
+
+    fig, ax, points = _get_scatter_template()
+    points.set_offsets(np.column_stack((batch.defense, hp_percent)))
+    x_pad = max(1, np.ptp(batch.defense) * 0.05)
+    ax.set_xlim(batch.defense.min() - x_pad, batch.defense.max() + x_pad)
+    ax.set_ylim(0, max(110, hp_percent.max() * 1.05))
+    ax.set_title(f'Random damage calculation with {samples} samples')
+
+    buffer = BytesIO()
+    fig.savefig(buffer, format='png')
+    return buffer.getvalue()
+
+
+class DamagePlotter:
+    """Renders damage plots in a pool of worker threads and caches them by
+    their inputs. Matching requests that come in while a plot is still
+    rendering share the one render.
+    """
+
+    def __init__(self, workers: int = PLOT_WORKERS,
+                 cache_size: int = PLOT_CACHE_SIZE) -> None:
+        self.workers = workers
+        self.cache = LRUCache(maxsize=cache_size)
+        self._pool = None
+        self._rendering = {}
+
+    @property
+    def pool(self) -> ThreadPoolExecutor:
+        # Made on first use so the bot doesn't start threads it may never
+        # need
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix='plotter'
+            )
+        return self._pool
+
+    async def damage_scatter(self, attacker_level: int, defender_level: int,
+                             power: int, atk: int, base_def: int,
+                             base_hp: int, mods: float,
+                             samples: int = PLOT_SAMPLES, seed: int = 0
+                             ) -> bytes:
+        """Gets the PNG from render_damage_scatter without blocking the
+        event loop.
+        """
+        key = (attacker_level, defender_level, power, atk, base_def,
+               base_hp, mods, samples, seed)
+        png = self.cache.get(key)
+        if png is not None:
+            return png
+
+        future = self._rendering.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().run_in_executor(
+                self.pool, render_damage_scatter, *key
+            )
+            self._rendering[key] = future
+            future.add_done_callback(
+                lambda _: self._rendering.pop(key, None)
+            )
+        # Shielded so one caller giving up doesn't cancel the render for
+        # everyone else waiting on it
+        png = await asyncio.shield(future)
+        self.cache.set(key, png)
+        return png
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+        self.cache.clear()
 
 
 if __name__ == '__main__':
-    damage_scatter(100, 100, 80, 372, 85, True, 2, 1.5, 90)
+    with open('./attachments/damage_scatter.png', 'wb') as file:
+        file.write(render_damage_scatter(100, 100, 80, 372, 85, 90, 4.5))
@@ -1,57 +1,186 @@
+import asyncio
+import json
+import os.path as osp
 import re
 from collections import defaultdict
-from datetime import timedelta
-from typing import Tuple, Union
+from typing import TYPE_CHECKING, Iterable, List, Tuple, Union
 
-import aiokemon as ak
-import requests
-import requests_cache
+import aiohttp
 
-from andybot.core.fuzzy_string import levenshtein_osa
+from andybot.cogs.pokemon.core.database import TYPE_COLUMNS, PokemonDB
+from andybot.cogs.pokemon.core.records import MoveRecord, PokemonRecord, \
+    TypeRecord
+from andybot.cogs.pokemon.core.session import PokeAPISession
+from andybot.core.cache import LRUCache
+from andybot.core.fuzzy_string import FuzzyIndex
+
+if TYPE_CHECKING:
+    from andybot.cogs.pokemon.core.typechart import TypeChart
 
 non_alpha = re.compile('[^a-z0-9]+')
 ignored_title_words = re.compile(r'\s?(pok[eé]mon|and)\s?', re.IGNORECASE)
-requests_cache.install_cache('./data/pokeapi', expire_after=timedelta(days=7))
-def _get_resource(url): return requests.get(url).json()['results']
+session = PokeAPISession()
+db = PokemonDB()
+resource_cache = LRUCache(maxsize=512)
+Record = Union[PokemonRecord, MoveRecord, TypeRecord]
+
+NAME_INDEX_PATH = './data/pokeapi_names.json'
+NAME_INDEX_KEYS = ('STATS_MAP', 'TYPES_MAP', 'POKEMON', 'GAMES', 'MOVES')
+MOVE_FANOUT = 16
+SUGGESTIONS = 4
+# Resources that get boiled down to a compact record as soon as they're
+# fetched instead of being kept around as raw JSON
+RESOURCE_RECORDS = {
+    'pokemon': PokemonRecord.from_resource,
+    'move': MoveRecord.from_resource,
+    'type': TypeRecord.from_resource,
+}
 
+# Lazily filled by load_name_index so importing this module never touches
+# the network. Module attributes like POKEMON are served by __getattr__.
+_name_index = {}
+_search_indexes = {}
+_pending_resources = {}
+_type_chart = None
 
-_stat_list = _get_resource('https://pokeapi.co/api/v2/stat')
-_type_list = _get_resource('https://pokeapi.co/api/v2/type')
-_pkmn_list = _get_resource('https://pokeapi.co/api/v2/pokemon?limit=10000')
-_game_list = _get_resource('https://pokeapi.co/api/v2/version-group')
-_move_list = _get_resource('https://pokeapi.co/api/v2/move?limit=10000')
 
-STATS_MAP = {
-    stat['name']: int(index) for index, stat in enumerate(_stat_list)
-    if index <= 5
-}
-TYPES_MAP = {
-    type_['name']: int(index) for index, type_ in enumerate(_type_list)
-    if type_['name'] not in {'unknown', 'shadow'}
-}
-POKEMON = {pokemon['name'] for pokemon in _pkmn_list}
-GAMES = {game['name'] for game in _game_list}
-MOVES = {move['name'] for move in _move_list}
+async def _get_resource(url): return (await get_by_url(url))['results']
+
+
+async def _fetch_name_index() -> dict:
+    """Gets every list resource the name index needs straight from
+    PokeAPI.
+    """
+    stat_list, type_list, pkmn_list, game_list, move_list = \
+        await asyncio.gather(
+            _get_resource('https://pokeapi.co/api/v2/stat'),
+            _get_resource('https://pokeapi.co/api/v2/type'),
+            _get_resource('https://pokeapi.co/api/v2/pokemon?limit=10000'),
+            _get_resource('https://pokeapi.co/api/v2/version-group'),
+            _get_resource('https://pokeapi.co/api/v2/move?limit=10000'),
+        )
+
+    return {
+        'STATS_MAP': {
+            stat['name']: int(index) for index, stat in enumerate(stat_list)
+            if index <= 5
+        },
+        'TYPES_MAP': {
+            type_['name']: int(index) for index, type_ in enumerate(type_list)
+            if type_['name'] not in {'unknown', 'shadow'}
+        },
+        'POKEMON': [pokemon['name'] for pokemon in pkmn_list],
+        'GAMES': [game['name'] for game in game_list],
+        'MOVES': [move['name'] for move in move_list],
+    }
+
+
+def _read_name_index(path: str) -> Union[dict, None]:
+    """Reads the name index snapshot. Returns None if there isn't a usable
+    one on disk.
+    """
+    if not osp.isfile(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            snapshot = json.load(file)
+    except (OSError, ValueError) as e:
+        print(f'Warning: Could not read name index snapshot {path}. {e}')
+        return None
+    if any(key not in snapshot for key in NAME_INDEX_KEYS):
+        return None
+    return snapshot
+
+
+def _write_name_index(path: str, snapshot: dict) -> None:
+    try:
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(snapshot, file)
+    except OSError as e:
+        print(f'Warning: Could not save name index snapshot {path}. {e}')
+
+
+def _set_name_index(snapshot: dict) -> dict:
+    _name_index.update(
+        STATS_MAP=snapshot['STATS_MAP'],
+        TYPES_MAP=snapshot['TYPES_MAP'],
+        POKEMON=set(snapshot['POKEMON']),
+        GAMES=set(snapshot['GAMES']),
+        MOVES=set(snapshot['MOVES']),
+    )
+    _search_indexes.update(
+        (key, FuzzyIndex(_name_index[key]))
+        for key in ('POKEMON', 'GAMES', 'MOVES')
+    )
+    return _name_index
+
+
+async def load_name_index(refresh: bool = False,
+                          path: str = NAME_INDEX_PATH) -> dict:
+    """Loads the stat, type, Pokemon, game and move names. Uses the local
+    snapshot if there is one and only goes to PokeAPI (saving a new
+    snapshot) if there isn't or if refresh is True.
+    """
+    if _name_index and not refresh:
+        return _name_index
+
+    snapshot = None if refresh else _read_name_index(path)
+    if snapshot is None:
+        snapshot = await _fetch_name_index()
+        _write_name_index(path, snapshot)
 
-del _stat_list, _type_list, _pkmn_list, _game_list, _move_list
+    return _set_name_index(snapshot)
 
 
-def get_by_url(url: str) -> dict:
+def __getattr__(name: str):
+    if name in NAME_INDEX_KEYS:
+        if not _name_index:
+            snapshot = _read_name_index(NAME_INDEX_PATH)
+            if snapshot is None:
+                raise RuntimeError(
+                    f'{name} is not available until load_name_index has '
+                    'been awaited.'
+                )
+            _set_name_index(snapshot)
+        return _name_index[name]
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+async def get_by_url(url: str) -> dict:
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-    except requests.exceptions.RequestException as e:
-        print(f'Could not get resource from url {url}. {e}')
+        return await session.get_json(url)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f'Could not get resource from url {url}. {e!r}')
         raise e
 
-    return response.json()
 
+async def get_by_resource(resource: str, id_or_name: Union[int, str] = '',
+                          args: str = '') -> Union[dict, Record]:
+    """Gets a PokeAPI resource, as a record if it's one of the
+    RESOURCE_RECORDS. Recently used resources are served from memory, and
+    concurrent requests for the same resource share one fetch.
+    """
+    key = (resource, str(id_or_name), args)
+    cached = resource_cache.get(key)
+    if cached is not None:
+        return cached
+
+    if key not in _pending_resources:
+        url = '/'.join(
+            ['https://pokeapi.co/api/v2', resource, str(id_or_name), args]
+        )
+        _pending_resources[key] = asyncio.ensure_future(get_by_url(url))
+    fetch = _pending_resources[key]
+    try:
+        body = await asyncio.shield(fetch)
+    finally:
+        if fetch.done():
+            _pending_resources.pop(key, None)
 
-def get_by_resource(resource: str, id_or_name: Union[int, str] = '',
-                    args: str = '') -> dict:
-    return get_by_url('/'.join(
-        ['https://pokeapi.co/api/v2', resource, str(id_or_name), args]
-    ))
+    to_record = RESOURCE_RECORDS.get(resource)
+    record = body if to_record is None else to_record(body)
+    resource_cache.set(key, record)
+    return record
 
 
 def reformat_match(match: str) -> str:
@@ -64,43 +193,64 @@ def format_game(game: str) -> str:
 
 
 def format_search(input: str) -> Tuple[str, str]:
-    alpha_strs = non_alpha.split(input)
-    return '-'.join(alpha_strs).lower(), '-'.join(reversed(alpha_strs)).lower()
+    # Lowercased before splitting, otherwise capitals count as separators
+    alpha_strs = [s for s in non_alpha.split(input.lower()) if s]
+    return '-'.join(alpha_strs), '-'.join(reversed(alpha_strs))
 
 
-def best_match(search: str, search_set: set) -> str:
-    """Searches an iterable for the most similar string."""
-    if search in search_set:
-        return search
+def suggest(search: str, index: FuzzyIndex, k: int = 1) -> List[str]:
+    """Gets the k entries of a search index most similar to a string, most
+    similar first. An exact match is always the only suggestion.
+    """
+    if search in index:
+        return [search]
 
-    matches = []
     search, reversed_search = format_search(search)
-
-    for entry in search_set:
-        matches.append((entry, levenshtein_osa(search, entry)))
+    # Names like Charizard or mr mime are only exact once they're formatted
+    for formatted in (search, reversed_search):
+        if formatted in index:
+            return [formatted]
+    matches = dict(index.search(search, k))
 
     if search != reversed_search:
-        for entry in search_set:
-            matches.append((entry, levenshtein_osa(reversed_search, entry)))
+        for entry, distance in index.search(reversed_search, k):
+            matches[entry] = min(distance, matches.get(entry, distance))
+
+    return sorted(matches, key=lambda entry: (matches[entry], entry))[:k]
 
-    matches.sort(key=lambda t: t[1])
-    return matches[0][0]
 
+def best_match(search: str, index: FuzzyIndex) -> str:
+    """Searches a search index for the most similar string."""
+    return suggest(search, index)[0]
 
-def best_match_pokemon(pokemon: str) -> str:
-    return best_match(pokemon, POKEMON)
 
+async def suggest_pokemon(pokemon: str, k: int = SUGGESTIONS) -> List[str]:
+    await load_name_index()
+    return suggest(pokemon, _search_indexes['POKEMON'], k)
 
-def best_match_move(move: str) -> str:
-    return best_match(move, MOVES)
 
+async def suggest_move(move: str, k: int = SUGGESTIONS) -> List[str]:
+    await load_name_index()
+    return suggest(move, _search_indexes['MOVES'], k)
 
-def best_match_game(game: str) -> str:
-    return best_match(format_game(game), GAMES)
 
+async def best_match_pokemon(pokemon: str) -> str:
+    await load_name_index()
+    return best_match(pokemon, _search_indexes['POKEMON'])
 
-def is_final_evo(mon_name: str, evo_url: str) -> bool:
-    cur_evo = get_by_url(evo_url)
+
+async def best_match_move(move: str) -> str:
+    await load_name_index()
+    return best_match(move, _search_indexes['MOVES'])
+
+
+async def best_match_game(game: str) -> str:
+    await load_name_index()
+    return best_match(format_game(game), _search_indexes['GAMES'])
+
+
+async def is_final_evo(mon_name: str, evo_url: str) -> bool:
+    cur_evo = await get_by_url(evo_url)
     all_evos = [cur_evo['chain']]
 
     while all_evos:
@@ -113,168 +263,112 @@ def is_final_evo(mon_name: str, evo_url: str) -> bool:
     return False
 
 
-def get_pokemon(pokemon: str) -> dict:
-    pokemon_dict = get_by_resource('pokemon', pokemon)
+async def get_pokemon(pokemon: str) -> PokemonRecord:
+    return await get_by_resource('pokemon', pokemon)
 
-    return pokemon_dict
 
+async def get_abilities(pokemon: str) -> list:
+    abilities_list = db.get_abilities(pokemon)
+    if abilities_list is not None:
+        return abilities_list
 
-def get_abilities(pokemon: str) -> list:
-    mon_dict = get_by_resource('pokemon', pokemon)
-    abilities_list = [None, None, None]  # Slot 1, slot 2, hidden ability
+    # Slot 1, slot 2, hidden ability
+    return list((await get_pokemon(pokemon)).abilities)
 
-    for ability in mon_dict['abilities']:
-        index = ability['slot']
-        abilities_list[index - 1] = ability['ability']['name']
 
-    return abilities_list
+async def get_types(pokemon: str) -> list:
+    types_list = db.get_types(pokemon)
+    if types_list is not None:
+        return types_list
 
+    return list((await get_pokemon(pokemon)).types)  # Slot 1, slot 2
 
-def get_types(pokemon: str) -> list:
-    mon_dict = get_by_resource('pokemon', pokemon)
-    types_list = [None, None]  # Slot 1, slot 2
 
-    for type_ in mon_dict['types']:
-        index = type_['slot']
-        types_list[index - 1] = type_['type']['name']
+async def get_stats(pokemon: str) -> list:
+    stats_list = db.get_stats(pokemon)
+    if stats_list is not None:
+        return stats_list
 
-    return types_list
+    return list((await get_pokemon(pokemon)).stats)
 
 
-def get_stats(pokemon: str) -> list:
-    mon_dict = get_by_resource('pokemon', pokemon)
-    stats_list = [-1 for i in range(6)]
+async def get_moves(pokemon: str, game: str) -> dict:
+    mon_moves = defaultdict(list)
+    mon_moves['level-up'] = defaultdict(list)
+    learned = (await get_pokemon(pokemon)).moves_in(game)
 
-    for stat in mon_dict['stats']:
-        index = STATS_MAP[stat['stat']['name']]
-        stats_list[index] = stat['base_stat']
+    moves_info = await get_moves_info(entry.move for entry in learned)
+    for entry in learned:
+        if entry.level > 0:
+            mon_moves['level-up'][entry.level].append(moves_info[entry.move])
+        else:
+            mon_moves[entry.method].append(moves_info[entry.move])
 
-    return stats_list
+    return mon_moves
 
 
-def get_moves(pokemon: str, game: str) -> dict:
-    mon_moves = defaultdict(list)
-    mon_moves['level-up'] = defaultdict(list)
-    mon_dict = get_by_resource('pokemon', pokemon)
-    moves = mon_dict['moves']
-
-    for move_entry in moves:
-        for version_group_entry in move_entry['version_group_details']:
-            if version_group_entry['version_group']['name'] == game:
-                move = move_entry['move']
-                method = version_group_entry['move_learn_method']['name']
-                level = int(version_group_entry['level_learned_at'])
-                move_info = get_move_info(move['name'])
-                if level > 0:
-                    mon_moves['level-up'][level].append(move_info)
-                else:
-                    mon_moves[method].append(move_info)
-                break
+async def get_moves_info(moves: Iterable[str],
+                         max_concurrent: int = MOVE_FANOUT) -> dict:
+    """Gets the info of several moves at once. Duplicate names are only
+    fetched once and at most max_concurrent requests are in flight at a time.
+    Returns a dict of move name to move info.
+    """
+    names = list(dict.fromkeys(moves))
+    limit = asyncio.Semaphore(max_concurrent)
 
-    return mon_moves
+    async def limited_move_info(move: str) -> MoveRecord:
+        async with limit:
+            return await get_move_info(move)
 
+    infos = await asyncio.gather(*(limited_move_info(m) for m in names))
+    return dict(zip(names, infos))
 
-def get_move_info(move: str) -> dict:
-    move_dict = get_by_resource('move', move)
-    move_info = {
-        'accuracy': move_dict['accuracy'],
-        'damage_class': move_dict['damage_class']['name'],
-        'effect_chance': move_dict['effect_chance'],
-        'name': move_dict['name'],
-        'power': move_dict['power'],
-        'pp': move_dict['pp'],
-        'priority': move_dict['priority'],
-        'type': move_dict['type']['name']
-    }
-    move_info['description'] = \
-        move_dict['effect_entries'][-1]['effect'].replace(
-            '$effect_chance', str(move_dict['effect_chance'])
-    )
-    return move_info
-
-
-def get_type_dmg_to(type_: str) -> list:
-    dmg_relations = get_by_resource('type', type_)['damage_relations']
-    dmg_to = [1.0 for i in range(18)]
-    double_dmg = dmg_relations['double_damage_to']
-    half_dmg = dmg_relations['half_damage_to']
-    no_dmg = dmg_relations['no_damage_to']
-
-    for type_ in double_dmg:
-        index = TYPES_MAP[type_['name']]
-        dmg_to[index] = 2
-    for type_ in half_dmg:
-        index = TYPES_MAP[type_['name']]
-        dmg_to[index] = 0.5
-    for type_ in no_dmg:
-        index = TYPES_MAP[type_['name']]
-        dmg_to[index] = 0
-
-    return dmg_to
-
-
-def get_type_dmg_from(type_: str) -> list:
-    dmg_relations = get_by_resource('type', type_)['damage_relations']
-    dmg_from = [1.0 for i in range(18)]
-    double_dmg = dmg_relations['double_damage_from']
-    half_dmg = dmg_relations['half_damage_from']
-    no_dmg = dmg_relations['no_damage_from']
-
-    for type_ in double_dmg:
-        index = TYPES_MAP[type_['name']]
-        dmg_from[index] = 2
-    for type_ in half_dmg:
-        index = TYPES_MAP[type_['name']]
-        dmg_from[index] = 0.5
-    for type_ in no_dmg:
-        index = TYPES_MAP[type_['name']]
-        dmg_from[index] = 0
-
-    return dmg_from
-
-
-def get_pkmn_type_info(pokemon: str) -> list:
-    slot_1, slot_2 = get_types(pokemon)
-    dmg_from = get_type_dmg_from(slot_1)
-    if slot_2 is not None:
-        dmg_from_slot_2 = get_type_dmg_from(slot_2)
-        for i in range(len(dmg_from)):
-            dmg_from[i] *= dmg_from_slot_2[i]
-    return dmg_from
-
-
-async def get_type_dmg_from(type_: ak.Type) -> list:
-    """Given a type APIResource instance, gets an array of that type's
-    weaknesses, resistances, and immunities.
+
+async def get_move_info(move: str) -> MoveRecord:
+    return await get_by_resource('move', move)
+
+
+async def get_type_chart() -> 'TypeChart':
+    """Gets the type chart, building it only once per process. It comes from
+    the saved chart, the local database, or PokeAPI, in that order.
     """
-    dmg_from = [1.0] * 18
-    dmg_relations = type_.damage_relations
-    double_dmg = dmg_relations.double_damage_from
-    half_dmg = dmg_relations.half_damage_from
-    no_dmg = dmg_relations.no_damage_from
-
-    for type_resource in double_dmg:
-        index = ak.get_resource_id(type_resource.url)
-        dmg_from[index - 1] = 2.0
-    for type_resource in half_dmg:
-        index = ak.get_resource_id(type_resource.url)
-        dmg_from[index - 1] = 0.5
-    for type_resource in no_dmg:
-        index = ak.get_resource_id(type_resource.url)
-        dmg_from[index - 1] = 0.0
-
-    return dmg_from
-
-
-async def get_pkmn_type_info(pokemon: ak.Pokemon) -> list:
-    """Given a Pokemon APIResource instance, gets an array of that Pokemon's
-    weaknesses, resistances, and immunities.
+    global _type_chart
+    if _type_chart is not None:
+        return _type_chart
+
+    # Imported here so numpy only loads once a command needs the chart
+    from andybot.cogs.pokemon.core.typechart import TypeChart
+
+    chart = TypeChart.load()
+    if chart is None:
+        dmg_from = db.get_all_type_dmg_from()
+        if dmg_from is None:
+            dmg_from = await asyncio.gather(
+                *(_fetch_type_dmg_from(type_) for type_ in TYPE_COLUMNS)
+            )
+        chart = TypeChart.from_dmg_from(dmg_from)
+        chart.save()
+
+    _type_chart = chart
+    return _type_chart
+
+
+async def _fetch_type_dmg_from(type_: str) -> list:
+    return list((await get_by_resource('type', type_)).dmg_from)
+
+
+async def get_type_dmg_to(type_: str) -> list:
+    return (await get_type_chart()).dmg_to(type_).tolist()
+
+
+async def get_type_dmg_from(type_: str) -> list:
+    """Gets an array of a type's weaknesses, resistances, and immunities."""
+    return (await get_type_chart()).dmg_from(type_).tolist()
+
+
+async def get_pkmn_type_info(pokemon: str) -> list:
+    """Gets an array of a Pokemon's weaknesses, resistances, and
+    immunities.
     """
-    slot_1 = await pokemon.types[0].type.as_resource()
-    dmg_from = await get_type_dmg_from(slot_1)
-    if len(pokemon.types) == 2:
-        slot_2 = await pokemon.types[1].type.as_resource()
-        dmg_from_slot_2 = await get_type_dmg_from(slot_2)
-        for i in range(len(dmg_from)):
-            dmg_from[i] *= dmg_from_slot_2[i]
-    return dmg_from
+    slot_1, slot_2 = await get_types(pokemon)
+    return (await get_type_chart()).dmg_from(slot_1, slot_2).tolist()
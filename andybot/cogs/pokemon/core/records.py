@@ -0,0 +1,128 @@
+from sys import intern
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from andybot.cogs.pokemon.core.database import TYPE_COLUMNS
+
+# PokeAPI stat names in the same order as the pokeapi STATS_MAP
+STAT_NAMES = ('hp', 'attack', 'defense', 'special-attack', 'special-defense',
+              'speed')
+
+
+class LearnedMove(NamedTuple):
+    """How a Pokemon learns a move in a version group."""
+    move: str
+    method: str
+    level: int
+
+
+class PokemonRecord(NamedTuple):
+    """The parts of a /pokemon resource the bot actually uses. Types,
+    abilities and stats are in slot/STAT_NAMES order and missing slots are
+    None. learnsets maps each version group to the first way the Pokemon
+    learns each of its moves there.
+    """
+    id: int
+    name: str
+    species: str
+    types: Tuple[str, Optional[str]]
+    abilities: Tuple[Optional[str], Optional[str], Optional[str]]
+    stats: Tuple[int, int, int, int, int, int]
+    learnsets: Dict[str, Tuple[LearnedMove, ...]]
+
+    @classmethod
+    def from_resource(cls, pokemon: dict) -> 'PokemonRecord':
+        types = [None, None]
+        for type_ in pokemon['types']:
+            types[type_['slot'] - 1] = intern(type_['type']['name'])
+        abilities = [None, None, None]
+        for ability in pokemon['abilities']:
+            abilities[ability['slot'] - 1] = intern(ability['ability']['name'])
+        base_stats = {s['stat']['name']: s['base_stat']
+                      for s in pokemon['stats']}
+        # Move, version group and method names repeat a lot between
+        # Pokemon, so they're interned to only be stored once. The same move
+        # is usually learned the same way across many version groups, so
+        # those share one LearnedMove too.
+        learned_moves = {}
+        learnsets = {}
+        for move_entry in pokemon['moves']:
+            move = intern(move_entry['move']['name'])
+            for details in move_entry['version_group_details']:
+                moves = learnsets.setdefault(
+                    intern(details['version_group']['name']), {}
+                )
+                if move in moves:
+                    continue
+                key = (move, intern(details['move_learn_method']['name']),
+                       int(details['level_learned_at']))
+                moves[move] = learned_moves.setdefault(key, LearnedMove(*key))
+        return cls(
+            id=pokemon['id'],
+            name=pokemon['name'],
+            species=pokemon['species']['name'],
+            types=tuple(types),
+            abilities=tuple(abilities),
+            stats=tuple(base_stats.get(name, -1) for name in STAT_NAMES),
+            learnsets={game: tuple(moves.values())
+                       for game, moves in learnsets.items()},
+        )
+
+    def moves_in(self, game: str) -> List[LearnedMove]:
+        """Gets the first way each move is learned in a version group."""
+        return list(self.learnsets.get(game, ()))
+
+
+class MoveRecord(NamedTuple):
+    """The parts of a /move resource the bot actually uses."""
+    name: str
+    type: str
+    damage_class: str
+    power: Optional[int]
+    accuracy: Optional[int]
+    pp: Optional[int]
+    priority: int
+    effect_chance: Optional[int]
+    description: str
+
+    @classmethod
+    def from_resource(cls, move: dict) -> 'MoveRecord':
+        effect_entries = move['effect_entries']
+        description = effect_entries[-1]['effect'] if effect_entries else ''
+        return cls(
+            name=move['name'],
+            type=intern(move['type']['name']),
+            damage_class=intern(move['damage_class']['name']),
+            power=move['power'],
+            accuracy=move['accuracy'],
+            pp=move['pp'],
+            priority=move['priority'],
+            effect_chance=move['effect_chance'],
+            description=description.replace(
+                '$effect_chance', str(move['effect_chance'])
+            ),
+        )
+
+
+class TypeRecord(NamedTuple):
+    """A type's damage relations as multipliers in TYPE_COLUMNS order."""
+    name: str
+    dmg_from: Tuple[float, ...]
+    dmg_to: Tuple[float, ...]
+
+    @staticmethod
+    def _multipliers(relations: dict, direction: str) -> Tuple[float, ...]:
+        dmg = dict.fromkeys(TYPE_COLUMNS, 1.0)
+        for key, multiplier in (('double', 2.0), ('half', 0.5), ('no', 0.0)):
+            for other in relations[f'{key}_damage_{direction}']:
+                if other['name'] in dmg:
+                    dmg[other['name']] = multiplier
+        return tuple(dmg[col] for col in TYPE_COLUMNS)
+
+    @classmethod
+    def from_resource(cls, type_: dict) -> 'TypeRecord':
+        relations = type_['damage_relations']
+        return cls(
+            name=type_['name'],
+            dmg_from=cls._multipliers(relations, 'from'),
+            dmg_to=cls._multipliers(relations, 'to'),
+        )
@@ -0,0 +1,134 @@
+import asyncio
+import json
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Any, Callable, Union
+
+import aiohttp
+
+# Not pokeapi.sqlite, which is where requests-cache used to keep its own
+# (differently laid out) cache
+CACHE_PATH = './data/pokeapi_responses.sqlite'
+CACHE_EXPIRE_AFTER = timedelta(days=7)
+LIMIT_PER_HOST = 8
+TIMEOUT = 10
+
+
+class ResponseCache:
+    """Tiny SQLite cache of JSON responses keyed by URL. PokeAPI data almost
+    never changes, so anything younger than expire_after gets reused instead
+    of going over the network again.
+
+    The connection belongs to whichever thread first uses the cache, so every
+    call after that has to come from the same thread.
+    """
+
+    def __init__(self, path: str = CACHE_PATH,
+                 expire_after: timedelta = CACHE_EXPIRE_AFTER) -> None:
+        self.path = path
+        self.expire_after = expire_after.total_seconds()
+        self._conn = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path)
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS responses ('
+                'url TEXT PRIMARY KEY, fetched REAL, body TEXT)'
+            )
+        return self._conn
+
+    def get(self, url: str) -> Union[dict, None]:
+        """Gets a cached response, or None if there isn't a fresh one (or
+        the cache can't be read), so the caller goes to the network.
+        """
+        try:
+            row = self.conn.execute(
+                'SELECT fetched, body FROM responses WHERE url = ?', (url,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            print(f'Warning: PokeAPI cache lookup failed. {e}')
+            return None
+        if row is None or time.time() - row[0] > self.expire_after:
+            return None
+        return json.loads(row[1])
+
+    def set(self, url: str, body: dict) -> None:
+        try:
+            with self.conn:
+                self.conn.execute(
+                    'INSERT OR REPLACE INTO responses VALUES (?, ?, ?)',
+                    (url, time.time(), json.dumps(body))
+                )
+        except sqlite3.Error as e:
+            print(f'Warning: Could not save {url} to PokeAPI cache. {e}')
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+class PokeAPISession:
+    """Shared aiohttp session for talking to PokeAPI. Keeps a pool of
+    connections alive between commands, caps how many requests can be in
+    flight to one host at once and gives up on requests that take too long.
+
+    Cache lookups and writes (SQLite and JSON decoding of bodies that can be
+    hundreds of KB) all run on one worker thread so they never block the
+    event loop.
+    """
+
+    def __init__(self, limit_per_host: int = LIMIT_PER_HOST,
+                 timeout: float = TIMEOUT,
+                 cache: Union[ResponseCache, None] = None) -> None:
+        self.limit_per_host = limit_per_host
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.cache = cache if cache is not None else ResponseCache()
+        self._session = None
+        self._cache_thread = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """The session is made on first use because aiohttp wants a running
+        event loop when it's created.
+        """
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit_per_host=self.limit_per_host
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector, timeout=self.timeout,
+                raise_for_status=True
+            )
+        return self._session
+
+    async def _run_in_cache_thread(self, func: Callable, *args: Any) -> Any:
+        if self._cache_thread is None:
+            self._cache_thread = ThreadPoolExecutor(max_workers=1)
+        return await asyncio.get_running_loop().run_in_executor(
+            self._cache_thread, func, *args
+        )
+
+    async def get_json(self, url: str) -> dict:
+        cached = await self._run_in_cache_thread(self.cache.get, url)
+        if cached is not None:
+            return cached
+
+        async with self.session.get(url) as response:
+            body = await response.json()
+
+        await self._run_in_cache_thread(self.cache.set, url, body)
+        return body
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+        if self._cache_thread is not None:
+            await self._run_in_cache_thread(self.cache.close)
+            self._cache_thread.shutdown()
+            self._cache_thread = None
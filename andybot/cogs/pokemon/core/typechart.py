@@ -0,0 +1,107 @@
+import os.path as osp
+from typing import Iterable, List, Sequence, Tuple, Union
+
+import numpy as np
+
+from andybot.cogs.pokemon.core.database import TYPE_COLUMNS
+
+CHART_PATH = './data/type_chart.npy'
+NUM_TYPES = len(TYPE_COLUMNS)
+TYPE_INDEX = {name: index for index, name in enumerate(TYPE_COLUMNS)}
+# Index used for the empty second slot of single-typed Pokemon
+NO_TYPE = NUM_TYPES
+
+Typing = Union[str, Tuple[str, Union[str, None]], Sequence[Union[str, None]]]
+
+
+class TypeChart:
+    """The full type chart as an 18x18 array, where chart[a, d] is the
+    multiplier an attacking type a gets against a defending type d.
+    """
+
+    def __init__(self, chart: np.ndarray) -> None:
+        self.chart = np.asarray(chart, dtype=np.float32)
+        # Row d is everything type d takes from each attacking type. The
+        # extra row of ones is the missing second type of single-typed
+        # Pokemon, so dual-type lookups never need to branch.
+        self._dmg_from = np.vstack(
+            (self.chart.T, np.ones(NUM_TYPES, dtype=np.float32))
+        )
+
+    @classmethod
+    def from_dmg_from(cls, dmg_from: Iterable[Sequence[float]]
+                      ) -> 'TypeChart':
+        """Makes a chart out of each defending type's damage taken, in the
+        same order as TYPE_COLUMNS.
+        """
+        return cls(np.array(list(dmg_from), dtype=np.float32).T)
+
+    @classmethod
+    def load(cls, path: str = CHART_PATH) -> Union['TypeChart', None]:
+        if not osp.isfile(path):
+            return None
+        try:
+            chart = np.load(path)
+        except (OSError, ValueError) as e:
+            print(f'Warning: Could not load type chart {path}. {e}')
+            return None
+        return cls(chart) if chart.shape == (NUM_TYPES, NUM_TYPES) else None
+
+    def save(self, path: str = CHART_PATH) -> None:
+        try:
+            np.save(path, self.chart)
+        except OSError as e:
+            print(f'Warning: Could not save type chart {path}. {e}')
+
+    @staticmethod
+    def typing_indices(typings: Iterable[Typing]) -> np.ndarray:
+        """Converts Pokemon typings, either a single type name or a pair of
+        names (where the second may be None), to an (n, 2) array of type
+        indices.
+        """
+        indices = []
+        for typing in typings:
+            if isinstance(typing, str):
+                typing = (typing, None)
+            slot_1, slot_2 = (tuple(typing) + (None,))[:2]
+            indices.append((
+                TYPE_INDEX[slot_1],
+                NO_TYPE if slot_2 is None else TYPE_INDEX[slot_2]
+            ))
+        return np.array(indices, dtype=np.intp).reshape(-1, 2)
+
+    def dmg_to(self, type_: str) -> np.ndarray:
+        """Multipliers of one attacking type against every defending type."""
+        return self.chart[TYPE_INDEX[type_]]
+
+    def dmg_from(self, type_1: str, type_2: Union[str, None] = None
+                 ) -> np.ndarray:
+        """Multipliers every attacking type gets against a single or dual
+        typing.
+        """
+        return self.dmg_from_many([(type_1, type_2)])[0]
+
+    def dmg_from_many(self, typings: Iterable[Typing]) -> np.ndarray:
+        """Same as dmg_from, but for many Pokemon at once. Returns an
+        (n, 18) array with one row per typing.
+        """
+        indices = self.typing_indices(typings)
+        return self._dmg_from[indices[:, 0]] * self._dmg_from[indices[:, 1]]
+
+    def matchups(self, attack_types: Iterable[str],
+                 defenders: Iterable[Typing]) -> np.ndarray:
+        """Multipliers for every attacking type against every defending
+        typing as a (k, n) array, e.g. a team's move types against another
+        team.
+        """
+        attacks = np.zeros((0, NUM_TYPES), dtype=np.float32)
+        attack_indices = [TYPE_INDEX[type_] for type_ in attack_types]
+        if attack_indices:
+            attacks = np.eye(NUM_TYPES, dtype=np.float32)[attack_indices]
+        return attacks @ self.dmg_from_many(defenders).T
+
+    def weakness_counts(self, defenders: Iterable[Typing]) -> List[int]:
+        """Counts how many of the given typings are weak to each attacking
+        type.
+        """
+        return (self.dmg_from_many(defenders) > 1).sum(axis=0).tolist()
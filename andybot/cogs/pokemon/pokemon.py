@@ -1,11 +1,25 @@
+import asyncio
+from io import BytesIO
+from typing import TYPE_CHECKING, List, Union
+
 import discord
 from discord.ext import commands
-from numpy import ndarray
 
-import andybot.cogs.pokemon.core.math as pokemath
 import andybot.cogs.pokemon.core.pokeapi as pokeapi
 from andybot.core.andybot import Andybot
-from andybot.cogs.pokemon.core.plotter import damage_scatter
+from andybot.cogs.pokemon.core.records import MoveRecord
+from andybot.cogs.pokemon.core.plotter import DamagePlotter
+
+if TYPE_CHECKING:
+    from andybot.cogs.pokemon.core.math import DamageSummary
+
+STAB = 1.5
+# How many defenders the damage command simulates
+DAMAGE_SAMPLES = 1_000_000
+DAMAGE_PLOT_NAME = 'damage.png'
+# Seed of the illustrative plot shown with exact odds, so a matchup always
+# gets the same (cached) plot
+DAMAGE_PLOT_SEED = 0
 
 
 class Pokemon(commands.Cog):
@@ -13,83 +27,195 @@ class Pokemon(commands.Cog):
 
     def __init__(self, bot: discord.Client) -> None:
         self.bot = bot
+        self.plotter = DamagePlotter()
+
+    def cog_unload(self) -> None:
+        self.bot.loop.create_task(pokeapi.session.close())
+        self.plotter.close()
 
     @commands.Cog.listener()
     async def on_ready(self):
+        # Warms up the name index so the first command doesn't have to wait
+        # on PokeAPI
+        await pokeapi.load_name_index()
         print('andybot pokemon helper is ready.')
 
     @commands.command(aliases=['wri', 'resistances'])
     async def weaknesses(self, ctx: commands.Context, *, pokemon: str) -> None:
         """Gets the weaknesses, resistances, and immunities of a Pokemon."""
         types_embed = Andybot.embed(title=pokemon)
-        pokemon_match = pokeapi.best_match_pokemon(pokemon)
-        type_info = pokeapi.get_pkmn_type_info(pokemon_match)
+        matches = await pokeapi.suggest_pokemon(pokemon)
+        pokemon_match = matches[0]
+        type_info = await pokeapi.get_pkmn_type_info(pokemon_match)
         for stat, index in pokeapi.TYPES_MAP.items():
             types_embed.add_field(name=stat, value=f'{type_info[index]:.2f}')
+        self._add_suggestions(types_embed, matches)
         await ctx.send(embed=types_embed)
 
     @commands.command()
     async def stats(self, ctx: commands.Context, *, pokemon: str) -> None:
         """Gets the stats of a Pokemon."""
-        pokemon_match = pokeapi.best_match_pokemon(pokemon)
-        stats = pokeapi.get_stats(pokemon_match)
+        matches = await pokeapi.suggest_pokemon(pokemon)
+        pokemon_match = matches[0]
+        stats = await pokeapi.get_stats(pokemon_match)
         stats_embed = Andybot.embed(title=pokemon)
         for stat, index in pokeapi.STATS_MAP.items():
             stats_embed.add_field(name=stat, value=stats[index])
+        self._add_suggestions(stats_embed, matches)
         await ctx.send(embed=stats_embed)
 
     @commands.command()
     async def move(self, ctx: commands.Context, *, move_name: str) -> None:
         """Gets the weaknesses, resistances, and immunities of a Pokemon."""
-        move_match = pokeapi.best_match_move(move_name)
+        matches = await pokeapi.suggest_move(move_name)
+        move_match = matches[0]
         move_name = pokeapi.reformat_match(move_match)
-        move = pokeapi.get_move_info(move_match)
-        filename = f'{move["type"]}-{move["damage_class"]}.png'
+        move = await pokeapi.get_move_info(move_match)
+        filename = f'{move.type}-{move.damage_class}.png'
         move_thumbnail = discord.File(
             f'./attachments/pkmn/moves/{filename}',
             filename=filename
         )
         move_embed = Andybot.embed(
             title=move_name,
-            description=move['description']
+            description=move.description
         ).set_thumbnail(
             url=f'attachment://{filename}'
         ).add_field(
-            name='Power', value=move['power'] or '--'
+            name='Power', value=move.power or '--'
         ).add_field(
-            name='Accuracy', value=move['accuracy']
+            name='Accuracy', value=move.accuracy
         ).add_field(
-            name='PP', value=move['pp']
+            name='PP', value=move.pp
         ).add_field(
-            name='Effect %', value=move['effect_chance'] or '--'
+            name='Effect %', value=move.effect_chance or '--'
         ).add_field(
-            name='Priority', value=move['priority']
+            name='Priority', value=move.priority
         )
+        self._add_suggestions(move_embed, matches)
         await ctx.send(embed=move_embed, file=move_thumbnail)
 
     @commands.command()
     async def moves(self, ctx: commands.Context, pokemon: str,
                     game: str) -> None:
         """Gets the moves of a Pokemon."""
-        mon_moves = pokeapi.get_moves(pokemon, game)
+        mon_moves = await pokeapi.get_moves(pokemon, game)
         moves_embed = Andybot.embed(title=pokemon)
         await ctx.send(embed=moves_embed)
 
     @commands.command(aliases=['dmg'])
     async def damage(self, ctx: commands.Context, attacker: str,
                      defender: str, attacker_level: int, defender_level: int,
-                     move: str, attacker_attack: int, extra_mods: float = 1.0
-                     ) -> None:
-        """Creates a scatterplot of potential damage done to a Pokemon."""
+                     move: str, attacker_attack: int, extra_mods: float = 1.0,
+                     seed: int = None) -> None:
+        """Works out how much damage a move does to a Pokemon across every
+        IV, EV and nature it could have, and how likely it is to KO. Giving
+        a seed runs a random simulation with it instead.
+        """
+        attacker_match = (await pokeapi.suggest_pokemon(attacker))[0]
+        defender_match = (await pokeapi.suggest_pokemon(defender))[0]
+        move_match = (await pokeapi.suggest_move(move))[0]
+        move_info = await pokeapi.get_move_info(move_match)
+        move_name = pokeapi.reformat_match(move_match)
+        if not move_info.power:
+            await ctx.send(f"{move_name} doesn't do direct damage.")
+            return
 
-    def _format_move(self, move: dict) -> str:
-        pass
+        defense_stat = 'defense' if move_info.damage_class == 'physical' \
+            else 'special-defense'
+        defender_stats = await pokeapi.get_stats(defender_match)
+        base_def = defender_stats[pokeapi.STATS_MAP[defense_stat]]
+        base_hp = defender_stats[pokeapi.STATS_MAP['hp']]
+        type_info = await pokeapi.get_pkmn_type_info(defender_match)
+        effectiveness = type_info[pokeapi.TYPES_MAP[move_info.type]]
+        stab = move_info.type in await pokeapi.get_types(attacker_match)
+        mods = (STAB if stab else 1.0) * effectiveness * extra_mods
+
+        plot_seed = DAMAGE_PLOT_SEED if seed is None else seed
+        summary, plot = await asyncio.gather(
+            self.bot.loop.run_in_executor(
+                None, self._damage, attacker_level, defender_level,
+                move_info.power, attacker_attack, base_def, base_hp, mods,
+                seed
+            ),
+            self._damage_plot(
+                attacker_level, defender_level, move_info.power,
+                attacker_attack, base_def, base_hp, mods, seed=plot_seed
+            )
+        )
 
-    def _damage(self, attacker: str, defender: str, attacker_level: int,
-                defender_level: int, move: str, attacker_attack: int,
-                extra_mods: float = 1.0) -> ndarray:
+        damage_embed = Andybot.embed(
+            title=f'{pokeapi.reformat_match(attacker_match)} {move_name} vs. '
+                  f'{pokeapi.reformat_match(defender_match)}'
+        ).add_field(
+            name='Damage',
+            value=f'{summary.min_percent:.1f}% - {summary.max_percent:.1f}%'
+        ).add_field(
+            name='Average', value=f'{summary.mean_percent:.1f}%'
+        ).add_field(
+            name='Modifiers',
+            value=f'{"STAB, " if stab else ""}{effectiveness:g}x type, '
+                  f'{extra_mods:g}x other'
+        )
+        for hits, chance in enumerate(summary.ko_chances, start=1):
+            damage_embed.add_field(name=f'{hits}HKO', value=f'{chance:.1%}')
+        if summary.exact:
+            footer = 'Exact odds over every IV, EV, nature and damage roll.'
+            plot_note = 'The plot is an illustrative fixed sample.'
+        else:
+            footer = f'{summary.samples:,} samples, seed {summary.seed}.'
+            plot_note = 'The plot is sampled with the same seed.'
+        if plot is None:
+            await ctx.send(embed=damage_embed.set_footer(text=footer))
+            return
+        damage_embed.set_footer(text=f'{footer} {plot_note}')
+        damage_embed.set_image(url=f'attachment://{DAMAGE_PLOT_NAME}')
+        await ctx.send(
+            embed=damage_embed,
+            file=discord.File(BytesIO(plot), filename=DAMAGE_PLOT_NAME)
+        )
+
+    def _add_suggestions(self, embed: discord.Embed, matches: List[str]
+                         ) -> None:
+        """Lists the runner-up matches of a fuzzy search in the footer of
+        an embed.
+        """
+        if len(matches) > 1:
+            others = ', '.join(pokeapi.reformat_match(m) for m in matches[1:])
+            embed.set_footer(
+                text=f'Showing {pokeapi.reformat_match(matches[0])}. '
+                     f'Did you mean: {others}?'
+            )
+
+    def _format_move(self, move: MoveRecord) -> str:
         pass
 
+    def _damage(self, attacker_level: int, defender_level: int, power: int,
+                attacker_attack: int, base_def: int, base_hp: int,
+                mods: float, seed: int = None) -> 'DamageSummary':
+        # Imported here so numpy only loads once someone asks for damage
+        import andybot.cogs.pokemon.core.math as pokemath
+
+        if seed is None:
+            return pokemath.exact_damage(
+                attacker_level, power, attacker_attack, base_def, base_hp,
+                defender_level, mods
+            )
+        return pokemath.simulate_damage(
+            attacker_level, power, attacker_attack, base_def, base_hp,
+            defender_level, mods, DAMAGE_SAMPLES, seed=seed
+        )
+
+    async def _damage_plot(self, *args, **kwargs) -> Union[bytes, None]:
+        """Renders the damage plot, or gives None if it can't be, since the
+        numbers are still worth sending without it.
+        """
+        try:
+            return await self.plotter.damage_scatter(*args, **kwargs)
+        except Exception as e:
+            print(f'Warning: Could not render damage plot. {e!r}')
+            return None
+
 
 def setup(client: discord.Client) -> None:
     client.add_cog(Pokemon(client))
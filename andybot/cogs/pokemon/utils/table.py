@@ -1,5 +1,7 @@
 from typing import Iterable
 
+from andybot.cogs.pokemon.core.records import MoveRecord
+
 LEFT = '╠'
 RIGHT = '╣'
 CENTER = '╬'
@@ -35,19 +37,19 @@ CATEGORIES = {
 """
 
 
-def moves_table(moves: dict, method: str) -> Iterable[int]:
+def moves_table(moves: Iterable[MoveRecord], method: str) -> Iterable[int]:
     moves_rows = []
     for move in moves:
-        name = move['name']
-        type_ = move['type']
+        name = move.name
+        type_ = move.type
         move_tuple = (
             method,
-            move['name'][:13],
-            move['type'][:7],
-            CATEGORIES[move['damage_class']],
-            move['power'],
-            move['accuracy'],
-            move['pp'],
-            move['effect_chance'] or '--',
+            move.name[:13],
+            move.type[:7],
+            CATEGORIES[move.damage_class],
+            move.power,
+            move.accuracy,
+            move.pp,
+            move.effect_chance or '--',
         )
         moves_rows.append(f"║ {' ║ '.join(move_tuple)} ║")
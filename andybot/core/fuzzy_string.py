@@ -1,33 +1,76 @@
-def levenshtein_osa(a: str, b: str) -> int:
+import heapq
+from collections import Counter, defaultdict
+from typing import Hashable, Iterable, List, Optional, Tuple
+
+
+def levenshtein_osa(a: str, b: str, max_distance: Optional[int] = None
+                    ) -> int:
     """A slightly-modified version of the traditional Levenshtein string
     distance algorithm that counts an adjacent character swap as one operation.
 
     For example, traditional Levenshtein would see ab and ba and need to do a
     deletion and then insertion (ab -> a -> ba) whereas this version can
     just swap them in one go.
+
+    Only the last three rows of the table are kept around. If max_distance
+    is given, the comparison stops as soon as every cell of a row is past it
+    (rows never get smaller, so the answer can only be worse) and
+    max_distance + 1 is returned instead of the real distance.
     """
     a_len = len(a)
     b_len = len(b)
-    D = [[0] * (b_len + 1) for i in range(a_len + 1)]
+    if max_distance is not None and abs(a_len - b_len) > max_distance:
+        return max_distance + 1
 
-    for i in range(a_len + 1):
-        D[i][0] = i
-    for j in range(b_len + 1):
-        D[0][j] = j
+    prev_2 = [0] * (b_len + 1)
+    prev = list(range(b_len + 1))
+    cur = [0] * (b_len + 1)
 
     for i in range(1, a_len + 1):
+        cur[0] = i
+        a_i = a[i - 1]
         for j in range(1, b_len + 1):
-            cost = (a[i - 1] != b[j - 1])
-            D[i][j] = min(D[i - 1][j] + 1,            # deletion
-                          D[i][j - 1] + 1,            # insertion
-                          D[i - 1][j - 1] + cost)     # substitution
-            if i > 1 and j > 1 and a[i - 1] == b[j - 2] \
-                    and a[i - 2] == b[j - 1]:
-                D[i][j] = min(
-                    D[i][j], D[i - 2][j - 2] + 1      # adjacent transposition
-                )
+            b_j = b[j - 1]
+            D = min(prev[j] + 1,                      # deletion
+                    cur[j - 1] + 1,                   # insertion
+                    prev[j - 1] + (a_i != b_j))       # substitution
+            if i > 1 and j > 1 and a_i == b[j - 2] and a[i - 2] == b_j \
+                    and prev_2[j - 2] + 1 < D:
+                D = prev_2[j - 2] + 1                 # adjacent transposition
+            cur[j] = D
+        if max_distance is not None and min(cur) > max_distance:
+            return max_distance + 1
+        prev_2, prev, cur = prev, cur, prev_2
+
+    if max_distance is not None and prev[-1] > max_distance:
+        return max_distance + 1
+    return prev[-1]
+
+
+def levenshtein_osa_batch(query: str, candidates: Iterable[str],
+                          max_distance: Optional[int] = None) -> List[int]:
+    """Computes the Levenshtein-OSA distance from one string to many. Same
+    max_distance behaviour as levenshtein_osa.
+    """
+    return [levenshtein_osa(query, candidate, max_distance)
+            for candidate in candidates]
+
 
-    return D[-1][-1]
+def closest_levenshtein_osa(query: str, candidates: Iterable[str]
+                            ) -> Tuple[Optional[int], Optional[int]]:
+    """Finds the index and distance of the candidate closest to query. Each
+    comparison is cut off as soon as it can't beat the best one so far, so
+    most candidates exit early. Ties go to the earliest candidate.
+    """
+    best_index, best_distance = None, None
+    for index, candidate in enumerate(candidates):
+        max_distance = None if best_distance is None else best_distance - 1
+        if max_distance is not None and max_distance < 0:
+            break
+        distance = levenshtein_osa(query, candidate, max_distance)
+        if best_distance is None or distance < best_distance:
+            best_index, best_distance = index, distance
+    return best_index, best_distance
 
 
 def lcs_table(search: str, text: str) -> int:
@@ -46,13 +89,168 @@ def lcs_table(search: str, text: str) -> int:
     return L
 
 
-def lcs_length(search: str, text: str) -> int:
+def lcs_length(search: str, text: str, min_length: Optional[int] = None
+               ) -> int:
     """Finds the length of the longest common subsequence between two
     strings.
+
+    Only two rows of the table are kept around. If min_length is given, the
+    comparison stops as soon as the rest of search couldn't possibly bring
+    the subsequence up to min_length, and 0 is returned.
     """
-    L = lcs_table(search, text)
+    search_len = len(search)
+    text_len = len(text)
+    if min_length is not None and min(search_len, text_len) < min_length:
+        return 0
+
+    prev = [0] * (text_len + 1)
+    cur = [0] * (text_len + 1)
+
+    for i in range(1, search_len + 1):
+        search_i = search[i - 1]
+        for j in range(1, text_len + 1):
+            if search_i == text[j - 1]:
+                cur[j] = prev[j - 1] + 1
+            elif prev[j] > cur[j - 1]:
+                cur[j] = prev[j]
+            else:
+                cur[j] = cur[j - 1]
+        if min_length is not None and \
+                cur[-1] + search_len - i < min_length:
+            return 0
+        prev, cur = cur, prev
+
+    return prev[-1]
+
+
+def lcs_length_batch(search: str, texts: Iterable[str],
+                     min_length: Optional[int] = None) -> List[int]:
+    """Finds the longest common subsequence length between one string and
+    many. Same min_length behaviour as lcs_length.
+    """
+    return [lcs_length(search, text, min_length) for text in texts]
+
+
+class FuzzyIndex:
+    """Index over a fixed set of strings for finding the ones closest to a
+    search by Levenshtein-OSA distance without comparing against all of them.
+
+    Entries are bucketed by length and buckets are visited nearest length
+    first. Two cheap lower bounds on the distance, the length difference and
+    the character count difference, let whole buckets and most entries be
+    skipped once they can't beat the matches found so far.
+    """
+
+    def __init__(self, entries: Iterable[str]) -> None:
+        self._entries = set(entries)
+        self._by_length = defaultdict(list)
+        for entry in sorted(self._entries):
+            self._by_length[len(entry)].append((entry, Counter(entry)))
+
+    def __contains__(self, entry: str) -> bool:
+        return entry in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def _count_bound(a: Counter, b: Counter) -> int:
+        """Each edit adds, removes, or replaces at most one character, so
+        it takes at least as many edits as there are surplus characters on
+        either side.
+        """
+        return max(sum((a - b).values()), sum((b - a).values()))
+
+    def search(self, query: str, k: int = 1) -> List[Tuple[str, int]]:
+        """Finds the k entries closest to query as (entry, distance) pairs,
+        closest first.
+        """
+        if k < 1:
+            return []
+
+        query_len = len(query)
+        query_counts = Counter(query)
+        # Max-heap (via negated distances) of the k best matches so far
+        best = []
+        lengths = sorted(self._by_length, key=lambda n: abs(n - query_len))
+
+        for length in lengths:
+            if len(best) == k and abs(length - query_len) >= -best[0][0]:
+                break
+            for entry, counts in self._by_length[length]:
+                if len(best) < k:
+                    distance = levenshtein_osa(query, entry)
+                    heapq.heappush(best, (-distance, entry))
+                    continue
+                worst = -best[0][0]
+                if self._count_bound(query_counts, counts) >= worst:
+                    continue
+                distance = levenshtein_osa(query, entry, worst - 1)
+                if distance < worst:
+                    heapq.heapreplace(best, (-distance, entry))
+
+        return sorted(((entry, -neg) for neg, entry in best),
+                      key=lambda t: (t[1], t[0]))
+
+
+def ngrams(text: str, n: int = 3) -> Counter:
+    """Counts the n-grams of a string, padded with a space on each side so
+    the start and end of the string make n-grams too.
+    """
+    padded = f' {text} '
+    return Counter(padded[i:i + n] for i in range(len(padded) - n + 1))
+
+
+class NgramIndex:
+    """Inverted index from n-grams to the keys whose text contains them, for
+    quickly narrowing a search down to the few entries worth comparing
+    properly. Unlike FuzzyIndex, keys can be added and removed at any time,
+    each in time proportional to the length of its text.
+    """
+
+    def __init__(self, n: int = 3) -> None:
+        self.n = n
+        self._texts = {}
+        self._postings = defaultdict(dict)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._texts
+
+    def __len__(self) -> int:
+        return len(self._texts)
+
+    def text(self, key: Hashable) -> str:
+        return self._texts[key]
+
+    def add(self, key: Hashable, text: str) -> None:
+        """Indexes a key under the given text, replacing its old text if it
+        was already indexed.
+        """
+        self.discard(key)
+        self._texts[key] = text
+        for gram, count in ngrams(text, self.n).items():
+            self._postings[gram][key] = count
+
+    def discard(self, key: Hashable) -> None:
+        text = self._texts.pop(key, None)
+        if text is None:
+            return
+        for gram in ngrams(text, self.n):
+            keys = self._postings[gram]
+            del keys[key]
+            if not keys:
+                del self._postings[gram]
 
-    return L[-1][-1]
+    def candidates(self, query: str, k: Optional[int] = None
+                   ) -> List[Tuple[Hashable, int]]:
+        """Finds the (at most k) keys sharing the most n-grams with query as
+        (key, shared n-grams) pairs, most shared first.
+        """
+        scores = Counter()
+        for gram, count in ngrams(query, self.n).items():
+            for key, key_count in self._postings.get(gram, {}).items():
+                scores[key] += min(count, key_count)
+        return scores.most_common(k)
 
 
 if __name__ == '__main__':
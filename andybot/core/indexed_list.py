@@ -0,0 +1,243 @@
+import random
+from collections.abc import MutableSequence
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+class _Node:
+    __slots__ = ('item', 'priority', 'size', 'left', 'right', 'parent')
+
+    def __init__(self, item: Any) -> None:
+        self.item = item
+        self.priority = random.random()
+        self.size = 1
+        self.left = None
+        self.right = None
+        self.parent = None
+
+
+def _size(node: Optional[_Node]) -> int:
+    return node.size if node is not None else 0
+
+
+def _update(node: _Node) -> None:
+    node.size = 1 + _size(node.left) + _size(node.right)
+    if node.left is not None:
+        node.left.parent = node
+    if node.right is not None:
+        node.right.parent = node
+
+
+def _split(node: Optional[_Node], k: int
+           ) -> Tuple[Optional[_Node], Optional[_Node]]:
+    """Splits a tree into its first k items and the rest."""
+    if node is None:
+        return None, None
+    if _size(node.left) >= k:
+        left, node.left = _split(node.left, k)
+        _update(node)
+        return left, node
+    node.right, right = _split(node.right, k - _size(node.left) - 1)
+    _update(node)
+    return node, right
+
+
+def _merge(left: Optional[_Node], right: Optional[_Node]
+           ) -> Optional[_Node]:
+    """Joins two trees, with every item of left coming before right's."""
+    if left is None:
+        return right
+    if right is None:
+        return left
+    if left.priority > right.priority:
+        left.right = _merge(left.right, right)
+        _update(left)
+        return left
+    right.left = _merge(left, right.left)
+    _update(right)
+    return right
+
+
+def _build(nodes: Iterable[_Node]) -> Optional[_Node]:
+    """Builds a tree out of nodes that are already in order in O(n), by
+    keeping the right spine of the tree on a stack.
+    """
+    spine = []
+    root = None
+    for node in nodes:
+        node.left = node.right = None
+        last = None
+        while spine and spine[-1].priority < node.priority:
+            last = spine.pop()
+            _update(last)
+        node.left = last
+        if spine:
+            spine[-1].right = node
+        spine.append(node)
+    while spine:
+        root = spine.pop()
+        _update(root)
+    return root
+
+
+class IndexedList(MutableSequence):
+    """A list backed by an implicit treap (a randomly balanced binary tree
+    ordered by position), so getting, inserting and deleting at any index
+    are all O(log n), unlike a deque's O(n) in the middle.
+
+    Every item also knows its own node, so finding, removing and checking
+    for an item are O(log n) too. Items are looked up by identity rather
+    than equality, which is what a queue of distinct objects wants anyway.
+    """
+
+    def __init__(self, iterable: Iterable = ()) -> None:
+        self._root = None
+        self._nodes: Dict[int, List[_Node]] = {}
+        self.extend(iterable)
+
+    def __len__(self) -> int:
+        return _size(self._root)
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({list(self)!r})'
+
+    def __iter__(self) -> Iterator:
+        return (node.item for node in self._iter_nodes())
+
+    def __contains__(self, item: Any) -> bool:
+        return id(item) in self._nodes
+
+    def _normalize(self, index: int) -> int:
+        length = self.__len__()
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError(f'{type(self).__name__} index out of range')
+        return index
+
+    def _node_at(self, index: int) -> _Node:
+        index = self._normalize(index)
+        node = self._root
+        while True:
+            left_size = _size(node.left)
+            if index < left_size:
+                node = node.left
+            elif index == left_size:
+                return node
+            else:
+                index -= left_size + 1
+                node = node.right
+
+    @staticmethod
+    def _position(node: _Node) -> int:
+        index = _size(node.left)
+        while node.parent is not None:
+            if node is node.parent.right:
+                index += _size(node.parent.left) + 1
+            node = node.parent
+        return index
+
+    def _set_root(self, root: Optional[_Node]) -> None:
+        if root is not None:
+            root.parent = None
+        self._root = root
+
+    def _track(self, node: _Node) -> None:
+        self._nodes.setdefault(id(node.item), []).append(node)
+
+    def _untrack(self, node: _Node) -> None:
+        nodes = self._nodes[id(node.item)]
+        nodes.remove(node)
+        if not nodes:
+            del self._nodes[id(node.item)]
+
+    def __getitem__(self, index: int) -> Any:
+        return self._node_at(index).item
+
+    def __setitem__(self, index: int, item: Any) -> None:
+        node = self._node_at(index)
+        self._untrack(node)
+        node.item = item
+        self._track(node)
+
+    def __delitem__(self, index: Any) -> None:
+        """Deletes an item, or a whole range of them at once if given a
+        slice (without a step).
+        """
+        if isinstance(index, slice):
+            if index.step not in (None, 1):
+                raise ValueError('Cannot delete a slice with a step.')
+            start, stop, _ = index.indices(self.__len__())
+            self._delete_range(start, max(start, stop))
+        else:
+            index = self._normalize(index)
+            self._delete_range(index, index + 1)
+
+    def _delete_range(self, start: int, stop: int) -> None:
+        left, rest = _split(self._root, start)
+        middle, right = _split(rest, stop - start)
+        self._set_root(_merge(left, right))
+        stack = [middle] if middle is not None else []
+        while stack:
+            node = stack.pop()
+            self._untrack(node)
+            stack.extend(child for child in (node.left, node.right)
+                         if child is not None)
+
+    def insert(self, index: int, item: Any) -> None:
+        """Inserts an item before index, clamping index like list does."""
+        length = self.__len__()
+        if index < 0:
+            index = max(0, index + length)
+        index = min(index, length)
+        node = _Node(item)
+        self._track(node)
+        left, right = _split(self._root, index)
+        self._set_root(_merge(_merge(left, node), right))
+
+    def popleft(self) -> Any:
+        if self._root is None:
+            raise IndexError(f'pop from an empty {type(self).__name__}')
+        return self.pop(0)
+
+    def index(self, item: Any, start: int = 0, stop: int = None) -> int:
+        """Finds the first position of an item (by identity)."""
+        stop = self.__len__() if stop is None else stop
+        positions = sorted(
+            self._position(node) for node in self._nodes.get(id(item), ())
+        )
+        for position in positions:
+            if start <= position < stop:
+                return position
+        raise ValueError(f'{item!r} is not in {type(self).__name__}')
+
+    def remove(self, item: Any) -> None:
+        del self[self.index(item)]
+
+    def move(self, old_index: int, new_index: int) -> None:
+        """Moves an item from one position to another."""
+        item = self[old_index]
+        del self[old_index]
+        self.insert(new_index, item)
+
+    def clear(self) -> None:
+        self._root = None
+        self._nodes.clear()
+
+    def shuffle(self) -> None:
+        """Shuffles the items in O(n) by rebuilding the tree with the nodes
+        in a random order.
+        """
+        nodes = list(self._iter_nodes())
+        random.shuffle(nodes)
+        self._set_root(_build(nodes))
+
+    def _iter_nodes(self) -> Iterator[_Node]:
+        stack = []
+        node = self._root
+        while stack or node is not None:
+            while node is not None:
+                stack.append(node)
+                node = node.left
+            node = stack.pop()
+            yield node
+            node = node.right
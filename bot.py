@@ -1,6 +1,7 @@
 import logging
 import os
 from os import path as osp
+from time import perf_counter
 
 import discord
 from discord.ext import commands
@@ -49,10 +50,21 @@ async def about(ctx: commands.Context) -> None:
 
 
 # Loads all cogs. Each cog must have a module-level setup function defined.
+# How long each one takes is printed so slow imports are easy to spot.
 cogs_dir = './andybot/cogs'
-for file_name in os.listdir(cogs_dir):
+startup_start = perf_counter()
+for file_name in sorted(os.listdir(cogs_dir)):
     if osp.isdir(osp.join(cogs_dir, file_name)) and not file_name.startswith('__'):
-        bot.load_extension(f'andybot.cogs.{file_name}.{file_name}')
+        cog_start = perf_counter()
+        try:
+            bot.load_extension(f'andybot.cogs.{file_name}.{file_name}')
+        except commands.ExtensionError as e:
+            # e.g. two cogs registering the same command name. Says which
+            # cog broke before stopping, rather than running without it
+            print(f'Error: Could not load {file_name}. {e.__cause__ or e}')
+            raise
+        print(f'Loaded {file_name} in {perf_counter() - cog_start:.3f} s')
+print(f'Loaded all cogs in {perf_counter() - startup_start:.3f} s')
 
 
 bot.run(cfg['token'])